@@ -1,17 +1,18 @@
 from pydantic_settings import BaseSettings
-from typing import List, Optional
-import os
-from datetime import timedelta
-import secrets
+from functools import lru_cache
 
 
 class Settings(BaseSettings):
     # Database
     database_url: str = "postgresql://rss_user:rss_password@db:5432/rss_db"
+    db_pool_size: int = 20
+    db_max_overflow: int = 40
+    db_pool_recycle: int = 1800  # seconds
     
     # OpenAI
     openai_api_key: str
     openai_temperature: float = 1.0
+    openai_max_retries: int = 6  # retries with exponential backoff on rate limits / transient errors
     
     # Email
     email_enabled: bool = True
@@ -24,7 +25,7 @@ class Settings(BaseSettings):
     email_log_content_length: int = 1000
     
     # Scheduling
-    scheduler_check_interval: int = 60  # seconds
+    scheduler_check_interval: int = 60  # seconds (unused since APScheduler; kept so existing .env files still load)
     cleanup_read_articles_days: int = 7  # days
     cleanup_unread_articles_limit: int = 1000  # articles
     cleanup_read_articles_hour: int = 3  # hour (JST)
@@ -36,7 +37,14 @@ class Settings(BaseSettings):
     
     # Summary settings
     max_articles_to_summarize: int = 10
+    summary_workers: int = 2  # background threads for PDF link extraction + summarization
     article_description_limit: int = 3000  # characters
+    article_description_max_tokens: int = 2000  # tokens (applied after the character limit)
+    semantic_cache_enabled: bool = True  # reuse summaries of near-duplicate descriptions
+    semantic_cache_threshold: float = 0.95  # cosine similarity
+    semantic_cache_candidates: int = 1000  # recent summarized articles to compare against
+    semantic_cache_min_chars: int = 200  # shorter descriptions are not cached
+    embedding_input_limit: int = 2000  # characters
     
     # App settings
     app_host: str = "0.0.0.0"
@@ -49,12 +57,16 @@ class Settings(BaseSettings):
     initial_feed_articles: int = 5
     stats_days_period: int = 7
     admin_email_logs_limit: int = 10
+    stats_cache_ttl: int = 30  # seconds (article/feed counts and /api/stats)
+    filter_options_cache_ttl: int = 60  # seconds (feed/keyword dropdowns on the article list)
     
     # Request settings
     request_timeout: int = 30  # seconds
+    feed_fetch_workers: int = 8  # concurrent feed downloads
     
     # GPT model
     gpt_model: str = 'o4-mini-2025-04-16'
+    embedding_model: str = 'text-embedding-3-small'
     
     # Fetch schedule
     rss_fetch_interval_hour :int = 6 # hours
@@ -64,4 +76,10 @@ class Settings(BaseSettings):
         case_sensitive = False
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    """Load settings once per process (.env is parsed only on the first call)"""
+    return Settings()
+
+
+settings = get_settings()
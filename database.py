@@ -1,20 +1,29 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, text
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, REAL
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 from sqlalchemy.sql import func
+from contextlib import contextmanager
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 from config import settings
 
-# JSTタイムゾーンを設定
-jst = pytz.timezone('Asia/Tokyo')
+# JSTタイムゾーンを設定（pytzより高速な標準ライブラリのzoneinfoを使用）
+JST = ZoneInfo('Asia/Tokyo')
 
 # 現在のJST時間を取得する関数
 def get_jst_now():
-    return datetime.now(jst)
+    return datetime.now(JST)
 
 # Database setup
-engine = create_engine(settings.database_url)
+engine = create_engine(
+    settings.database_url,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_pre_ping=True,  # 切断済みの接続をリクエスト中に掴まないよう事前に確認
+    pool_recycle=settings.db_pool_recycle,
+    pool_use_lifo=True,  # よく使う接続を温かいまま再利用する
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -28,15 +37,41 @@ class RSSFeed(Base):
     description = Column(Text)
     is_active = Column(Boolean, default=True)
     filter_keywords = Column(Text, nullable=True)  # フィードごとのフィルタリングキーワード
+    etag = Column(String, nullable=True)  # 条件付きGET用（前回レスポンスのETag）
+    last_modified = Column(String, nullable=True)  # 条件付きGET用（前回レスポンスのLast-Modified）
     created_at = Column(DateTime, default=get_jst_now)
     updated_at = Column(DateTime, default=get_jst_now, onupdate=get_jst_now)
     
     # Relationship
-    articles = relationship("Article", back_populates="feed")
+    # 記事コレクションの暗黙的な遅延ロードはN+1の原因になるため禁止する（必要な場合はselectinloadを明示）
+    # フィード削除時の記事の紐付け解除はDBの外部キー（ON DELETE SET NULL）に任せる
+    articles = relationship("Article", back_populates="feed", lazy="raise", passive_deletes=True)
 
 
 class Article(Base):
     __tablename__ = "articles"
+    __table_args__ = (
+        # キーワードの部分一致検索（ILIKE '%keyword%'）をpg_trgmのGINインデックスで処理する
+        Index(
+            "ix_articles_keywords_trgm",
+            "keywords",
+            postgresql_using="gin",
+            postgresql_ops={"keywords": "gin_trgm_ops"},
+        ),
+        # フィードごとの既存記事チェック（link IN (...)）をインデックスだけで処理する
+        Index("ix_articles_link_guid", "link", "guid"),
+        # 新しい順の一覧表示と、統計の期間指定（created_at >= ...）で使う
+        Index("ix_articles_created_at_id", "created_at", "id"),
+        # 記事一覧の既定（未読のみ）とフィード指定の絞り込みを、並べ替えなしでページ分だけ読む
+        Index("ix_articles_unread_created_at_id", "created_at", "id", postgresql_where=text("is_read = false")),
+        # feed_idが先頭なので、フィード削除時のON DELETE SET NULLの対象行探しにも使われる
+        Index("ix_articles_feed_created_at_id", "feed_id", "created_at", "id"),
+        # 未読記事の新しい順の取得・削除と、既読記事の期限切れ削除で使う（対象行だけを持つ部分インデックス）
+        Index("ix_articles_unread_published", "published_date", postgresql_where=text("is_read = false")),
+        Index("ix_articles_read_read_at", "read_at", postgresql_where=text("is_read = true")),
+        # 未要約記事の取得で使う
+        Index("ix_articles_unsummarized", "id", postgresql_where=text("is_summarized = false")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
@@ -48,10 +83,14 @@ class Article(Base):
     is_read = Column(Boolean, default=False)
     read_at = Column(DateTime, nullable=True)
     is_summarized = Column(Boolean, default=False)
+    summary_claimed_at = Column(DateTime, nullable=True)  # 要約処理の担当を確保した時刻（二重にAPIを呼ばないため）
     summary = Column(Text)
     keywords = Column(Text)  # キーワードをカンマ区切りの文字列として保存
     pdf_link = Column(String)  # PDFへのリンク
-    image_urls = Column(Text)  # 画像URLをJSON形式で保存
+    image_urls = Column(JSONB)  # 画像URLのリスト（PostgreSQLのバイナリJSONで保存）
+    content_hash = Column(String(64), index=True)  # タイトル+説明文のSHA-256（フィード間の重複検出用）
+    # 説明文の埋め込み（近似重複記事の要約流用用）。画面では使わない大きな列なので、明示的に参照したときだけ読む
+    description_embedding = deferred(Column(ARRAY(REAL), nullable=True))
     is_favorite = Column(Boolean, default=False, nullable=False, server_default=text("false"))
     
     # 落合フォーマットの各セクション
@@ -66,10 +105,11 @@ class Article(Base):
     updated_at = Column(DateTime, default=get_jst_now, onupdate=get_jst_now)
     
     # Foreign key
-    feed_id = Column(Integer, ForeignKey("rss_feeds.id"))
+    feed_id = Column(Integer, ForeignKey("rss_feeds.id", ondelete="SET NULL"))
     
     # Relationships
-    feed = relationship("RSSFeed", back_populates="articles")
+    # 一覧表示でarticle.feed.titleを参照するため、フィードはまとめてSELECT ... IN で取得する
+    feed = relationship("RSSFeed", back_populates="articles", lazy="selectin")
 
 
 
@@ -82,7 +122,7 @@ class EmailLog(Base):
     subject = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     articles_count = Column(Integer, default=0)
-    sent_at = Column(DateTime, default=get_jst_now)
+    sent_at = Column(DateTime, default=get_jst_now, index=True)  # 管理画面の新しい順一覧用
     status = Column(String, default="sent")  # sent, failed
 
 
@@ -95,18 +135,57 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def session_scope():
+    """バッチ処理用のセッション（正常終了でcommit、例外でrollbackし、必ず接続をプールに返す）"""
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
 def create_tables():
-    Base.metadata.create_all(bind=engine)
-    # Ensure new columns exist when the schema evolves without explicit migrations
+    # DDLはPostgreSQLではトランザクション内で実行できるため、全体を1つのトランザクションで行う
     with engine.begin() as connection:
+        # トライグラムインデックスに必要な拡張をテーブル作成前に有効化する
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        Base.metadata.create_all(bind=connection)
+        # Ensure new columns exist when the schema evolves without explicit migrations
+        # （1回の往復でまとめて送る）
         connection.execute(text("""
             ALTER TABLE articles
-            ADD COLUMN IF NOT EXISTS is_favorite BOOLEAN NOT NULL DEFAULT false
-        """))
-        connection.execute(text("""
-            ALTER TABLE articles
-            ADD COLUMN IF NOT EXISTS read_at TIMESTAMP
+                ADD COLUMN IF NOT EXISTS is_favorite BOOLEAN NOT NULL DEFAULT false,
+                ADD COLUMN IF NOT EXISTS read_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS summary_claimed_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS description_embedding REAL[];
+            ALTER TABLE rss_feeds
+                ADD COLUMN IF NOT EXISTS etag VARCHAR,
+                ADD COLUMN IF NOT EXISTS last_modified VARCHAR;
+            DO $$
+            BEGIN
+                IF (SELECT data_type FROM information_schema.columns
+                    WHERE table_name = 'articles' AND column_name = 'image_urls') = 'text' THEN
+                    ALTER TABLE articles ALTER COLUMN image_urls TYPE JSONB USING NULLIF(image_urls, '')::jsonb;
+                END IF;
+                IF EXISTS (SELECT 1 FROM pg_constraint
+                           WHERE conname = 'articles_feed_id_fkey' AND confdeltype <> 'n') THEN
+                    ALTER TABLE articles
+                        DROP CONSTRAINT articles_feed_id_fkey,
+                        ADD CONSTRAINT articles_feed_id_fkey FOREIGN KEY (feed_id)
+                            REFERENCES rss_feeds (id) ON DELETE SET NULL;
+                END IF;
+            END $$;
         """))
+        # create_all()は既存テーブルに後から宣言したインデックスを作らないため個別に作成する
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import re
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -5,13 +6,41 @@ from email.mime.base import MIMEBase
 from email import encoders
 from typing import Optional, List
 from config import settings
-from database import get_db, EmailLog, Article
+from database import SessionLocal, EmailLog, Article, get_jst_now
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
 import logging
-from datetime import datetime
+import threading
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_HEADER_RE = re.compile(r"^(#{1,3}) (.*)$", re.MULTILINE)
+_BOLD_RE = re.compile(r"\*\*(.*?)\*\*")
+
+# メール本文を囲むHTMLの外枠はJinja2テンプレートとして一度だけコンパイルしておく
+_EMAIL_ENV = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape(["html"]))
+_EMAIL_TEMPLATE = _EMAIL_ENV.get_template("email.html")
+
+
+def _render_header(match: re.Match) -> str:
+    level = len(match.group(1))
+    return f"<h{level}>{match.group(2)}</h{level}>"
+
+
+def _markdown_body(markdown_content: str) -> str:
+    """Convert the markdown body to an HTML fragment"""
+    # Convert headers and bold text
+    html = _HEADER_RE.sub(_render_header, markdown_content)
+    html = _BOLD_RE.sub(r"<strong>\1</strong>", html)
+
+    # Convert line breaks and wrap in paragraphs
+    html = html.replace("\n\n", "</p><p>").replace("\n", "<br>")
+    html = f"<p>{html}</p>"
+
+    # Convert horizontal rules
+    return html.replace("---", "<hr>")
+
 
 class EmailSender:
     def __init__(self):
@@ -20,9 +49,52 @@ class EmailSender:
         self.username = settings.email_user
         self.password = settings.email_password
         self.from_email = settings.email_from
+        # 送信ごとのTLSハンドシェイクと認証を避けるため接続を使い回す
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open a new authenticated SMTP connection"""
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        server.starttls()
+        server.login(self.username, self.password)
+        return server
+
+    def _get_conn(self) -> smtplib.SMTP:
+        """Return the cached SMTP connection, reconnecting if it has dropped
+
+        Must be called with self._lock held.
+        """
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except (smtplib.SMTPException, OSError):
+                self._reset_conn()
+        self._smtp = self._connect()
+        return self._smtp
+
+    def _reset_conn(self) -> None:
+        """Drop the cached SMTP connection"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+
+    def close(self) -> None:
+        """Close the cached SMTP connection"""
+        with self._lock:
+            self._reset_conn()
 
     def send_email(
-        self, to_email: str, subject: str, content: str, content_type: str = "html"
+        self,
+        to_email: str,
+        subject: str,
+        content: str,
+        content_type: str = "html",
+        articles_count: int = 0,
     ) -> bool:
         """Send email with the given content"""
         try:
@@ -42,127 +114,29 @@ class EmailSender:
             msg.attach(text_part)
             msg.attach(html_part)
 
-            # Connect to server and send email
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.send_message(msg)
+            # Send over the cached connection, retrying once if the server dropped it
+            with self._lock:
+                try:
+                    self._get_conn().send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    self._reset_conn()
+                    self._get_conn().send_message(msg)
 
             logger.info(f"Email sent successfully to {to_email}")
 
             # Log email to database
-            self.log_email(to_email, subject, content, "sent")
+            self.log_email(to_email, subject, content, "sent", articles_count)
             return True
 
         except Exception as e:
             logger.error(f"Failed to send email to {to_email}: {e}")
-            self.log_email(to_email, subject, content, "failed")
+            self.log_email(to_email, subject, content, "failed", articles_count)
             return False
 
     def markdown_to_html(self, markdown_content: str) -> str:
         """Convert simple markdown to HTML"""
-        html = markdown_content
-
-        # Convert headers
-        html = html.replace("# ", "<h1>").replace("\n# ", "</h1>\n<h1>")
-        html = html.replace("## ", "<h2>").replace("\n## ", "</h2>\n<h2>")
-        html = html.replace("### ", "<h3>").replace("\n### ", "</h3>\n<h3>")
-
-        # Convert bold text
-        import re
-
-        html = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", html)
-
-        # Convert line breaks
-        html = html.replace("\n\n", "</p><p>")
-        html = html.replace("\n", "<br>")
-
-        # Wrap in paragraphs
-        html = f"<p>{html}</p>"
-
-        # Fix headers (close them properly)
-        html = re.sub(r"<h1>(.*?)<br>", r"<h1>\1</h1>", html)
-        html = re.sub(r"<h2>(.*?)<br>", r"<h2>\1</h2>", html)
-        html = re.sub(r"<h3>(.*?)<br>", r"<h3>\1</h3>", html)
-
-        # Convert horizontal rules
-        html = html.replace("---", "<hr>")
-
-        # Add basic HTML structure
-        html_template = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>RSS要約レポート</title>
-    <style>
-        body {{
-            font-family: 'Helvetica Neue', Arial, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }}
-        .container {{
-            background-color: white;
-            padding: 30px;
-            border-radius: 8px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }}
-        h1 {{
-            color: #2c3e50;
-            border-bottom: 3px solid #3498db;
-            padding-bottom: 10px;
-        }}
-        h2 {{
-            color: #34495e;
-            margin-top: 30px;
-            border-left: 4px solid #3498db;
-            padding-left: 15px;
-        }}
-        h3 {{
-            color: #7f8c8d;
-            margin-top: 20px;
-        }}
-        hr {{
-            border: none;
-            height: 2px;
-            background-color: #ecf0f1;
-            margin: 30px 0;
-        }}
-        strong {{
-            color: #2c3e50;
-        }}
-        a {{
-            color: #3498db;
-            text-decoration: none;
-        }}
-        a:hover {{
-            text-decoration: underline;
-        }}
-        .footer {{
-            margin-top: 40px;
-            padding-top: 20px;
-            border-top: 1px solid #ecf0f1;
-            color: #7f8c8d;
-            font-size: 0.9em;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        {html}
-        <div class="footer">
-            <p>このメールは RSS要約システム により自動生成されました。</p>
-        </div>
-    </div>
-</body>
-</html>
-"""
-        return html_template
+        # 本文は変換済みのHTMLなのでエスケープせずにテンプレートへ埋め込む
+        return _EMAIL_TEMPLATE.render(body=Markup(_markdown_body(markdown_content)))
 
     def log_email(
         self,
@@ -173,58 +147,39 @@ class EmailSender:
         articles_count: int = 0,
     ):
         """Log email to database"""
-        db = next(get_db())
-        try:
-            email_log = EmailLog(
-                recipient=recipient,
-                subject=subject,
-                content=content[
-                    : settings.email_log_content_length
-                ],  # Limit content length
-                articles_count=articles_count,
-                status=status,
-            )
-            db.add(email_log)
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Error logging email: {e}")
-        finally:
-            db.close()
+        with SessionLocal() as db:
+            try:
+                email_log = EmailLog(
+                    recipient=recipient,
+                    subject=subject,
+                    content=content[
+                        : settings.email_log_content_length
+                    ],  # Limit content length
+                    articles_count=articles_count,
+                    status=status,
+                )
+                db.add(email_log)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error logging email: {e}")
 
     def send_daily_summary(self) -> bool:
         """Send daily summary email"""
 
         subject = f"今日の論文要約レポート"
         to_email = settings.email_to
-        content = self.create_daily_summary_content()
-        success = self.send_email(to_email, subject, content)
-
-        if success:
-            # Update log with articles count
-            db = next(get_db())
-            try:
-                latest_log = (
-                    db.query(EmailLog)
-                    .filter(EmailLog.recipient == to_email, EmailLog.subject == subject)
-                    .order_by(EmailLog.sent_at.desc())
-                    .first()
-                )
-
-                if latest_log:
-                    db.commit()
-            except Exception as e:
-                db.rollback()
-                logger.error(f"Error updating email log: {e}")
-            finally:
-                db.close()
+        articles = self.get_unread_articles(limit=settings.max_articles_to_summarize)
+        content = self.create_daily_summary_content(articles)
 
-        return success
+        # 記事数はメールログの挿入時にまとめて記録する
+        return self.send_email(
+            to_email, subject, content, articles_count=len(articles)
+        )
 
     def get_unread_articles(self, limit: int = None) -> List[Article]:
         """Get unread articles for summary email"""
-        db = next(get_db())
-        try:
+        with SessionLocal() as db:
             # keywordsはリレーションシップではなくテキストカラムなのでjoinedloadは不要
             query = db.query(Article).filter(Article.is_read == False)
 
@@ -236,13 +191,10 @@ class EmailSender:
 
             articles = query.all()
             return articles
-        finally:
-            db.close()
 
-    def create_daily_summary_content(self) -> str:
+    def create_daily_summary_content(self, articles: List[Article]) -> str:
         """Create daily summary email content"""
 
-        articles = self.get_unread_articles(limit=settings.max_articles_to_summarize)
         if not articles:
             return "新しい記事がありません。"
 
@@ -250,7 +202,7 @@ class EmailSender:
 
         email_content = f"""
 # 日次記事要約レポート
-生成日時: {datetime.now().strftime("%Y年%m月%d日 %H:%M")}
+生成日時: {get_jst_now().strftime("%Y年%m月%d日 %H:%M")}
 記事数: {len(articles)}件
 
 ---
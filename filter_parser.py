@@ -1,9 +1,25 @@
 import re
-from typing import List, Dict, Any, Optional, Tuple, Union
+from functools import lru_cache
+from typing import List, Any, Optional, Tuple, Union, Container
 import logging
 
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasickが無い環境では部分文字列検索にフォールバックする
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+# 特殊トークン（OR, AND, (, ), ,）と、それ以外の単語を1つの正規表現で切り出す
+_TOKEN_RE = re.compile(r'\(|\)|,|\bOR\b|\bAND\b|(?:(?!\bOR\b|\bAND\b)[^\s(),])+')
+_SPECIAL_TOKENS = frozenset(['OR', 'AND', '(', ')', ','])
+
+# 構文木のノードはタグ付きタプルで表す（dictより小さく、評価時のアクセスも速い）
+#   キーワード: ('K', keyword, keyword_lower)
+#   AND:        ('A', left, right)
+#   OR:         ('O', left, right)
+Node = Tuple[Any, ...]
+
 class FilterParser:
     """
     論理演算（OR、AND）とグループ化（カッコ）をサポートするフィルター構文パーサー
@@ -23,6 +39,8 @@ class FilterParser:
       例えば、"python tutorial OR test"は"python tutorial"と"test"の2つのキーワードに分割されます。
     """
     
+    __slots__ = ('tokens', 'current_token_index', 'current_token')
+    
     def __init__(self):
         self.tokens = []
         self.current_token_index = 0
@@ -38,67 +56,27 @@ class FilterParser:
         Returns:
             トークンのリスト
         """
-        # 空白を正規化
-        expression = filter_expression.strip()
-        
-        # 特殊トークン（OR, AND, (, ), ,）の前後にスペースを追加
-        expression = re.sub(r'\(', ' ( ', expression)
-        expression = re.sub(r'\)', ' ) ', expression)
-        expression = re.sub(r'\bOR\b', ' OR ', expression)
-        expression = re.sub(r'\bAND\b', ' AND ', expression)
-        expression = re.sub(r',', ' , ', expression)
-        
-        # 連続する空白を1つにまとめる
-        expression = re.sub(r'\s+', ' ', expression)
-        
-        # 特殊トークンのリスト
-        special_tokens = ['OR', 'AND', '(', ')', ',']
-        
-        # トークンに分割
-        if expression:
-            raw_tokens = expression.split(' ')
-            # 空のトークンを削除
-            raw_tokens = [token for token in raw_tokens if token]
-            
-            # 特殊トークン以外の連続するトークンをまとめる
-            tokens = []
-            current_phrase = []
-            in_parentheses = 0  # カッコ内のレベルを追跡
-            
-            for token in raw_tokens:
-                if token == '(':
-                    # 現在の文章があれば追加
-                    if current_phrase:
-                        tokens.append(' '.join(current_phrase))
-                        current_phrase = []
-                    # 開きカッコを追加
-                    tokens.append(token)
-                    in_parentheses += 1
-                elif token == ')':
-                    # 現在の文章があれば追加
-                    if current_phrase:
-                        tokens.append(' '.join(current_phrase))
-                        current_phrase = []
-                    # 閉じカッコを追加
-                    tokens.append(token)
-                    in_parentheses -= 1
-                elif token in special_tokens:
-                    # 現在の文章があれば追加
-                    if current_phrase:
-                        tokens.append(' '.join(current_phrase))
-                        current_phrase = []
-                    # 特殊トークンを追加
-                    tokens.append(token)
-                else:
-                    # 通常のトークンは文章に追加
-                    current_phrase.append(token)
-            
-            # 最後の文章があれば追加
-            if current_phrase:
-                tokens.append(' '.join(current_phrase))
-            
-            return tokens
-        return []
+        tokens = []
+        current_phrase = []
+        
+        # 1回の走査で特殊トークンと単語を切り出し、特殊トークン以外の連続する単語を文章としてまとめる
+        for token in _TOKEN_RE.findall(filter_expression):
+            if token in _SPECIAL_TOKENS:
+                # 現在の文章があれば追加
+                if current_phrase:
+                    tokens.append(' '.join(current_phrase))
+                    current_phrase = []
+                # 特殊トークンを追加
+                tokens.append(token)
+            else:
+                # 通常のトークンは文章に追加
+                current_phrase.append(token)
+        
+        # 最後の文章があれば追加
+        if current_phrase:
+            tokens.append(' '.join(current_phrase))
+        
+        return tokens
     
     def parse(self, filter_expression: str) -> Any:
         """
@@ -134,7 +112,7 @@ class FilterParser:
         else:
             self.current_token = None
     
-    def parse_expression(self) -> Dict[str, Any]:
+    def parse_expression(self) -> Node:
         """
         式を解析する
         
@@ -148,22 +126,22 @@ class FilterParser:
         while self.current_token and self.current_token == 'OR':
             self.get_next_token()  # 'OR'をスキップ
             right = self.parse_term()
-            left = {'type': 'OR', 'left': left, 'right': right}
+            left = ('O', left, right)
         
         return left
     
-    def parse_term(self) -> Dict[str, Any]:
+    def parse_term(self) -> Node:
         """項を解析する"""
         left = self.parse_factor()
         
         while self.current_token and self.current_token == 'AND':
             self.get_next_token()  # 'AND'をスキップ
             right = self.parse_factor()
-            left = {'type': 'AND', 'left': left, 'right': right}
+            left = ('A', left, right)
         
         return left
     
-    def parse_factor(self) -> Dict[str, Any]:
+    def parse_factor(self) -> Node:
         """因子を解析する"""
         if not self.current_token:
             raise SyntaxError("予期しないトークンの終わり")
@@ -183,11 +161,12 @@ class FilterParser:
         if self.current_token not in ['AND', 'OR', '(', ')']:
             keyword = self.current_token
             self.get_next_token()
-            return {'type': 'KEYWORD', 'value': keyword}
+            # 評価のたびに小文字化しないよう、解析時に小文字のキーワードも保持しておく
+            return ('K', keyword, keyword.lower())
         
         raise SyntaxError(f"予期しないトークン: {self.current_token}")
     
-    def evaluate(self, ast: Dict[str, Any], text: str) -> bool:
+    def evaluate(self, ast: Node, text: str) -> bool:
         """
         構文木を評価して、テキストがフィルター条件にマッチするかどうかを判定する
         
@@ -202,28 +181,29 @@ class FilterParser:
             return False
         
         # テキストを小文字に変換（大文字小文字を区別しない）
-        text_lower = text.lower()
+        return self._evaluate_impl(ast, text.lower())
+    
+    def _evaluate_impl(self, ast: Node, text_lower: str) -> bool:
+        """小文字化済みのテキストに対して構文木を再帰的に評価する"""
+        if not ast:
+            return False
         
         # ノードのタイプに応じて評価
-        node_type = ast.get('type')
+        tag = ast[0]
         
-        if node_type == 'KEYWORD':
-            keyword = ast.get('value', '').lower()
-            return keyword in text_lower
+        if tag == 'K':
+            return ast[2] in text_lower
         
-        elif node_type == 'AND':
-            left = self.evaluate(ast.get('left', {}), text)
-            right = self.evaluate(ast.get('right', {}), text)
-            return left and right
+        # 左辺で結果が確定した場合は右辺を評価しない
+        elif tag == 'A':
+            return self._evaluate_impl(ast[1], text_lower) and self._evaluate_impl(ast[2], text_lower)
         
-        elif node_type == 'OR':
-            left = self.evaluate(ast.get('left', {}), text)
-            right = self.evaluate(ast.get('right', {}), text)
-            return left or right
+        elif tag == 'O':
+            return self._evaluate_impl(ast[1], text_lower) or self._evaluate_impl(ast[2], text_lower)
         
         return False
     
-    def get_matching_keywords(self, ast: Dict[str, Any], text: str) -> List[str]:
+    def get_matching_keywords(self, ast: Node, text: str) -> List[str]:
         """
         構文木を評価して、テキストにマッチするキーワードのリストを取得する
         
@@ -238,30 +218,43 @@ class FilterParser:
             return []
         
         # テキストを小文字に変換（大文字小文字を区別しない）
-        text_lower = text.lower()
+        return self._collect_matches(ast, text.lower())
+    
+    def _collect_matches(self, ast: Node, hits: Container[str]) -> List[str]:
+        """
+        構文木を1回だけ走査してマッチしたキーワードを集める
         
-        # ノードのタイプに応じて評価
-        node_type = ast.get('type')
+        マッチしたキーワードが1つ以上あることと、式全体がマッチすることは同値なので、
+        evaluateとget_matching_keywordsの2回の走査をこの1回にまとめられる
         
-        if node_type == 'KEYWORD':
-            keyword = ast.get('value', '')
-            keyword_lower = keyword.lower()
-            if keyword_lower in text_lower:
-                return [keyword]
+        Args:
+            ast: 構文木
+            hits: Aho-Corasickで見つかった小文字キーワードの集合、
+                  またはオートマトンが使えない場合は小文字化済みの評価対象テキスト
+            
+        Returns:
+            マッチしたキーワードのリスト
+        """
+        tag = ast[0]
+        
+        if tag == 'K':
+            if ast[2] in hits:
+                return [ast[1]]
             return []
         
-        elif node_type == 'AND':
-            left_matches = self.get_matching_keywords(ast.get('left', {}), text)
-            right_matches = self.get_matching_keywords(ast.get('right', {}), text)
-            # ANDの場合は両方のキーワードがマッチする必要がある
-            if left_matches and right_matches:
+        elif tag == 'A':
+            left_matches = self._collect_matches(ast[1], hits)
+            # 左辺がマッチしなければANDは成立しないので右辺は走査しない
+            if not left_matches:
+                return []
+            right_matches = self._collect_matches(ast[2], hits)
+            if right_matches:
                 return left_matches + right_matches
             return []
         
-        elif node_type == 'OR':
-            left_matches = self.get_matching_keywords(ast.get('left', {}), text)
-            right_matches = self.get_matching_keywords(ast.get('right', {}), text)
-            # ORの場合はいずれかのキーワードがマッチすればよい
+        elif tag == 'O':
+            left_matches = self._collect_matches(ast[1], hits)
+            right_matches = self._collect_matches(ast[2], hits)
             return left_matches + right_matches
         
         return []
@@ -278,27 +271,100 @@ class FilterParser:
         Returns:
             (マッチするかどうか, マッチしたキーワードのリスト)
         """
-        try:
-            # フィルター式を解析
-            ast = self.parse(filter_expression)
-            if not ast:
-                return False, []
-            
-            # 評価
-            matches = self.evaluate(ast, text)
-            matching_keywords = self.get_matching_keywords(ast, text)
+        return self.parse_and_evaluate_batch(filter_expression, [text])[0]
+    
+    def parse_and_evaluate_batch(self, filter_expression: str, texts: List[str]) -> List[Tuple[bool, List[str]]]:
+        """
+        フィルター式を1回だけ解析・コンパイルし、複数のテキストをまとめて評価する
+        
+        Args:
+            filter_expression: フィルター式
+            texts: 評価対象のテキストのリスト
             
-            return matches, matching_keywords
+        Returns:
+            テキストごとの(マッチするかどうか, マッチしたキーワードのリスト)のリスト
+        """
+        try:
+            # フィルター式を解析（同じ式は記事ごとに再解析せずキャッシュを使う）
+            ast, automaton = _compile_cached(filter_expression)
         except Exception as e:
             logger.error(f"フィルター式の解析中にエラーが発生しました: {e}")
             # エラーが発生した場合は、単純なカンマ区切りのキーワードとして扱う
-            keywords = [kw.strip() for kw in filter_expression.split(',') if kw.strip()]
-            matching_keywords = []
-            for keyword in keywords:
-                if keyword.lower() in text.lower():
-                    matching_keywords.append(keyword)
-            
-            return len(matching_keywords) > 0, matching_keywords
+            keywords, automaton = _compile_fallback_cached(filter_expression)
+            results = []
+            for text in texts:
+                hits = _find_hits(automaton, text.lower())
+                matching_keywords = [keyword for keyword, keyword_lower in keywords if keyword_lower in hits]
+                results.append((len(matching_keywords) > 0, matching_keywords))
+            return results
+        
+        if not ast:
+            return [(False, []) for _ in texts]
+        
+        results = []
+        for text in texts:
+            # 評価（テキストの小文字化は1回だけ）
+            matching_keywords = self._collect_matches(ast, _find_hits(automaton, text.lower()))
+            results.append((bool(matching_keywords), matching_keywords))
+        return results
+
+@lru_cache(maxsize=1024)
+def _parse_cached(filter_expression: str) -> Any:
+    """フィルター式の構文木をキャッシュする（構文木は読み取り専用として共有する）"""
+    return FilterParser().parse(filter_expression)
+
+
+def _iter_keywords(ast: Node):
+    """構文木に含まれるキーワードを列挙する"""
+    if ast[0] == 'K':
+        yield ast[2]
+    else:
+        yield from _iter_keywords(ast[1])
+        yield from _iter_keywords(ast[2])
+
+
+@lru_cache(maxsize=1024)
+def _compile_cached(filter_expression: str) -> Tuple[Any, Optional[Any]]:
+    """
+    フィルター式の構文木と、全キーワードを1つにまとめたAho-Corasickオートマトンを返す
+    
+    キーワードごとにテキストを走査する代わりに、オートマトンで1回の走査で全キーワードを検出する
+    """
+    ast = _parse_cached(filter_expression)
+    if not ast:
+        return ast, None
+    return ast, _build_automaton(_iter_keywords(ast))
+
+
+@lru_cache(maxsize=256)
+def _compile_fallback_cached(filter_expression: str) -> Tuple[List[Tuple[str, str]], Optional[Any]]:
+    """
+    解析できなかったフィルター式をカンマ区切りのキーワードとして扱うための
+    (キーワード, 小文字のキーワード)のリストとオートマトンを返す
+    """
+    keywords = [(kw.strip(), kw.strip().lower()) for kw in filter_expression.split(',') if kw.strip()]
+    return keywords, _build_automaton(keyword_lower for _, keyword_lower in keywords)
+
+
+def _build_automaton(keywords_lower) -> Optional[Any]:
+    """小文字のキーワード群からAho-Corasickオートマトンを構築する（pyahocorasickが無ければNone）"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword_lower in keywords_lower:
+        automaton.add_word(keyword_lower, keyword_lower)
+    if len(automaton) == 0:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+def _find_hits(automaton: Optional[Any], text_lower: str) -> Container[str]:
+    """テキスト中に出現するキーワード（小文字）の集合を返す"""
+    if automaton is None:
+        # オートマトンが無い場合はテキスト自体を返し、キーワードごとの部分文字列検索で判定する
+        return text_lower
+    return {keyword for _, keyword in automaton.iter(text_lower)}
 
 
 # 使用例
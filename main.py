@@ -18,10 +18,14 @@ def main():
     logger.info("Database tables initialized")
     
     # Start the web application
+    # イベントループとHTTPパーサーはC実装（uvloop/httptools）を使う
+    # スケジューラーと集計キャッシュがプロセス内にあるため、ワーカーは1プロセスのままにする
     uvicorn.run(
         app,
         host=settings.app_host,
         port=settings.app_port,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
 
@@ -1,12 +1,18 @@
 import feedparser
-import requests
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import queue
+import threading
 from datetime import datetime, timezone, timedelta
-import pytz
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from database import get_db, Article, RSSFeed
-from typing import List, Optional, Tuple
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import session_scope, Article, RSSFeed, JST
+from summarizer import _SUMMARY_FAILURE_PREFIX
+from typing import Dict, List, Optional, Set, Tuple
 import logging
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import re
 import json
 from filter_parser import FilterParser
@@ -15,29 +21,103 @@ from config import settings
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 停止時に処理中の記事を待つ最大秒数（要約のAPI呼び出し1回分程度）
+_WORKER_STOP_TIMEOUT = 60
+
+# 落合フォーマットの各セクションのカラム（重複記事の要約を流用するときにコピーする）
+_SUMMARY_SECTION_FIELDS = ('top_summary', 'comparison', 'technique', 'validation', 'discussion', 'next_papers')
+
+# PDFリンクを探すパターン（一般的なパターン、先頭ほど優先）
+# 記事ごとに作り直さないようモジュール読み込み時に一度だけ用意する
+_PDF_PATTERNS = (
+    # href属性に.pdfを含むリンク
+    lambda a, href, string: bool(href) and href.endswith('.pdf'),
+    # PDFダウンロードボタンなど、テキストに'PDF'を含むリンク
+    lambda a, href, string: bool(string) and 'PDF' in string.upper(),
+    # クラス名やIDにpdfを含む要素
+    lambda a, href, string: 'pdf' in (a.get('class') or '').lower(),
+    lambda a, href, string: 'pdf' in (a.get('id') or '').lower(),
+    # data-format属性がpdfのリンク（arXivなど）
+    lambda a, href, string: a.get('data-format') == 'pdf',
+    # 特定のサイト向けのパターン（arXiv）
+    lambda a, href, string: a.get('title') == 'Download PDF',
+    # href属性にpdfを含むリンク（arXiv新パターン）
+    lambda a, href, string: bool(href) and 'pdf' in href.lower(),
+    # テキストが"View PDF"のリンク（arXiv新パターン）
+    lambda a, href, string: bool(string) and 'View PDF' in string,
+    # class属性にdownload-pdfを含むリンク（arXiv新パターン）
+    lambda a, href, string: 'download-pdf' in (a.get('class') or ''),
+)
+
+
+def _single_string(node) -> Optional[str]:
+    """BeautifulSoupのTag.stringと同様に、子要素が1つだけの場合にその文字列を返す"""
+    while True:
+        children = list(node.iter(include_text=True))
+        if len(children) != 1:
+            return None
+        node = children[0]
+        if node.is_text_node:
+            return node.text_content
+
 
 class RSSFetcher:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'RSS Summarizer Bot 1.0'
-        })
-        # Import summarizer here to avoid circular imports
-        from summarizer import ArticleSummarizer
-        self.summarizer = ArticleSummarizer()
+    def __init__(self, summarizer=None):
+        # 同じホスト（arXivなど）へのリクエストをHTTP/2の1接続に多重化する
+        self.session = httpx.Client(
+            http2=True,
+            follow_redirects=True,
+            headers={'User-Agent': 'RSS Summarizer Bot 1.0'},
+            timeout=settings.request_timeout,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+        if summarizer is None:
+            # Import summarizer here to avoid circular imports
+            from summarizer import ArticleSummarizer
+            summarizer = ArticleSummarizer()
+        self.summarizer = summarizer
         # フィルターパーサーを初期化
         self.filter_parser = FilterParser()
+        # 新着記事のPDFリンク抽出・要約を行うワーカー（最初に記事を登録したときに起動）
+        self._article_queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._workers_lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+        # キューに入っている・処理中の記事ID（同じ記事を二重に積まない）
+        self._queued_ids: Set[int] = set()
+
+    def close(self) -> None:
+        """Close the pooled HTTP connections"""
+        self.session.close()
+        self.summarizer.close()
 
-    def fetch_feed(self, feed_url: str) -> Optional[dict]:
-        """Fetch RSS feed from URL"""
+    def fetch_feed(
+        self,
+        feed_url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Optional[dict]:
+        """Fetch RSS feed from URL (returns None if unchanged since etag/last_modified)"""
         try:
-            response = self.session.get(feed_url, timeout=settings.request_timeout)
+            # 前回取得時のETag/Last-Modifiedを送り、更新が無ければ本文のダウンロードと解析を省く
+            headers = {}
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            response = self.session.get(feed_url, headers=headers, timeout=settings.request_timeout)
+            if response.status_code == 304:
+                logger.info(f"Feed not modified: {feed_url}")
+                return None
             response.raise_for_status()
             
             feed = feedparser.parse(response.content)
             if feed.bozo:
                 logger.warning(f"Feed parsing warning for {feed_url}: {feed.bozo_exception}")
             
+            feed['etag'] = response.headers.get('ETag')
+            feed['modified'] = response.headers.get('Last-Modified')
             return feed
         except Exception as e:
             logger.error(f"Error fetching feed {feed_url}: {e}")
@@ -48,18 +128,12 @@ class RSSFetcher:
         if not html_content:
             return ""
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        tree = LexborHTMLParser(html_content)
         # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        # Get text and clean it
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
+        tree.strip_tags(["script", "style"])
         
-        return text
+        # 連続する空白・改行を1回の置換で1つのスペースにまとめる
+        return _WHITESPACE_RE.sub(' ', tree.root.text()).strip()
         
     def extract_pdf_link(self, article_url: str) -> Optional[str]:
         """
@@ -76,34 +150,25 @@ class RSSFetcher:
             response.raise_for_status()
             
             # HTMLをパース
-            soup = BeautifulSoup(response.content, 'html.parser')
+            tree = LexborHTMLParser(response.content)
             
-            # PDFリンクを探す（一般的なパターン）
-            pdf_patterns = [
-                # href属性に.pdfを含むリンク
-                lambda s: s.find('a', href=lambda href: href and href.endswith('.pdf')),
-                # PDFダウンロードボタンなど、テキストに'PDF'を含むリンク
-                lambda s: s.find('a', text=lambda text: text and 'PDF' in text.upper()),
-                # クラス名やIDにpdfを含む要素
-                lambda s: s.find('a', class_=lambda c: c and 'pdf' in c.lower()),
-                lambda s: s.find('a', id=lambda i: i and 'pdf' in i.lower()),
-                # data-format属性がpdfのリンク（arXivなど）
-                lambda s: s.find('a', attrs={'data-format': 'pdf'}),
-                # 特定のサイト向けのパターン（arXiv）
-                lambda s: s.find('a', attrs={'title': 'Download PDF'}),
-                # href属性にpdfを含むリンク（arXiv新パターン）
-                lambda s: s.find('a', href=lambda href: href and 'pdf' in href.lower()),
-                # テキストが"View PDF"のリンク（arXiv新パターン）
-                lambda s: s.find('a', text=lambda text: text and 'View PDF' in text),
-                # class属性にdownload-pdfを含むリンク（arXiv新パターン）
-                lambda s: s.find('a', class_=lambda c: c and 'download-pdf' in c)
-            ]
-
-            # 各パターンを試す
-            for pattern in pdf_patterns:
-                pdf_link_element = pattern(soup)
-                if pdf_link_element and 'href' in pdf_link_element.attrs:
-                    pdf_url = pdf_link_element['href']
+            # <a>要素を1回だけ走査し、パターンごとに最初にマッチした要素を記録する
+            first_matches = [None] * len(_PDF_PATTERNS)
+            for node in tree.css('a'):
+                attrs = node.attributes
+                href = attrs.get('href')
+                string = _single_string(node)
+                for index, pattern in enumerate(_PDF_PATTERNS):
+                    if first_matches[index] is None and pattern(attrs, href, string):
+                        first_matches[index] = attrs
+                # 最優先のパターンが見つかればそれ以上走査する必要はない
+                if first_matches[0] is not None:
+                    break
+            
+            # 優先順にパターンの結果を確認する
+            for attrs in first_matches:
+                if attrs is not None and 'href' in attrs:
+                    pdf_url = attrs['href'] or ''
                     
                     # 相対URLの場合は絶対URLに変換
                     if pdf_url.startswith('/'):
@@ -132,8 +197,7 @@ class RSSFetcher:
                 utc_dt = datetime(*date_string[:6], tzinfo=timezone.utc)
                 
                 # Convert to JST (UTC+9)
-                jst = pytz.timezone('Asia/Tokyo')
-                jst_dt = utc_dt.astimezone(jst)
+                jst_dt = utc_dt.astimezone(JST)
                 
                 return jst_dt
         except Exception as e:
@@ -149,6 +213,20 @@ class RSSFetcher:
             query = query.filter(Article.guid == guid)
         return query.first() is not None
 
+    def get_existing_articles(self, db: Session, entries: List[dict]) -> Dict[str, Set[str]]:
+        """
+        フィードのエントリのうち既にDBにある記事を1回のクエリで取得する
+        Returns a mapping of link -> set of guids stored for that link
+        """
+        links = {entry.get('link', '') for entry in entries}
+        existing: Dict[str, Set[str]] = {}
+        if not links:
+            return existing
+        rows = db.query(Article.link, Article.guid).filter(Article.link.in_(links))
+        for link, guid in rows:
+            existing.setdefault(link, set()).add(guid)
+        return existing
+
     def check_keywords_match(self, db: Session, title: str, description: str, feed: RSSFeed = None) -> Tuple[str, List[str]]:
         """
         Check if title or description matches the filter expression
@@ -181,118 +259,286 @@ class RSSFetcher:
             logger.error(f"フィルター式の評価中にエラーが発生しました: {e}")
             # エラーが発生した場合は、従来の方法でフィルタリング
             feed_keywords = [kw.strip() for kw in feed.filter_keywords.split(',') if kw.strip()]
-            matching_keywords = []
-            for keyword in feed_keywords:
-                if keyword.lower() in text.lower():
-                    matching_keywords.append(keyword)
+            # テキストの小文字化はキーワードごとではなく1回だけ行う
+            text_lower = text.lower()
+            matching_keywords = [keyword for keyword in feed_keywords if keyword.lower() in text_lower]
             
             result = "None" if len(matching_keywords) == 0 else "Match"
             return result, matching_keywords
 
-    def save_article(self, db: Session, feed: RSSFeed, entry: dict) -> Optional[Article]:
-        """Save article to database"""
-        try:
-            # Extract article data
-            title = entry.get('title', 'No Title')
-            link = entry.get('link', '')
-            description = self.clean_html(entry.get('description', ''))
-            author = entry.get('author', '')
-            published_date = self.parse_date(entry.get('published_parsed', ''))
-            guid = entry.get('guid', link)
-
-            # Check if article already exists
-            if self.article_exists(db, link, guid):
-                logger.info(f"Article already exists: {title}")
-                return None
+    def prepare_article_row(
+        self,
+        db: Session,
+        feed: RSSFeed,
+        entry: dict,
+        existing: Optional[Dict[str, Set[str]]] = None,
+    ) -> Optional[dict]:
+        """Build the column values for a new article, or None if it should be skipped"""
+        # Extract article data
+        title = entry.get('title', 'No Title')
+        link = entry.get('link', '')
+        guid = entry.get('guid', link)
 
-            # Check if article matches any keywords
-            result, matching_keywords = self.check_keywords_match(db, title, description, feed)
-            if result == "None":
-                logger.info(f"Article does not match any keywords: {title}")
-                return None
+        # Check if article already exists
+        if existing is not None:
+            # get_existing_articlesで取得済みの結果を使い、記事ごとのクエリを省く
+            exists = link in existing and (not guid or guid in existing[link])
+        else:
+            exists = self.article_exists(db, link, guid)
+        if exists:
+            logger.info(f"Article already exists: {title}")
+            return None
 
-            # Create new article
-            article = Article(
-                title=title,
-                link=link,
-                description=description,
-                author=author,
-                published_date=published_date,
-                guid=guid,
-                feed_id=feed.id
-            )
+        description = self.clean_html(entry.get('description', ''))
+        author = entry.get('author', '')
+        published_date = self.parse_date(entry.get('published_parsed', ''))
 
-            db.add(article)
-            db.flush()  # Get the article ID
+        # Check if article matches any keywords
+        result, matching_keywords = self.check_keywords_match(db, title, description, feed)
+        if result == "None":
+            logger.info(f"Article does not match any keywords: {title}")
+            return None
 
+        return {
+            'title': title,
+            'link': link,
+            'description': description,
+            'author': author,
+            'published_date': published_date,
+            'guid': guid,
+            'feed_id': feed.id,
             # キーワードをカンマ区切りの文字列として保存
-            article.keywords = ','.join(matching_keywords)
-            
-            # PDFリンクを抽出して保存
+            'keywords': ','.join(matching_keywords),
+            'content_hash': hashlib.sha256(f"{title}{description}".encode('utf-8')).hexdigest(),
+        }
+
+    def save_articles(
+        self,
+        db: Session,
+        feed: RSSFeed,
+        entries: List[dict],
+        existing: Optional[Dict[str, Set[str]]] = None,
+    ) -> List[int]:
+        """Save new articles of a feed with a single bulk INSERT and return their IDs"""
+        if existing is None:
+            existing = self.get_existing_articles(db, entries)
+
+        rows = []
+        for entry in entries:
             try:
-                pdf_link = self.extract_pdf_link(link)
-                if pdf_link:
-                    article.pdf_link = pdf_link
-                    logger.info(f"PDFリンクを保存しました: {pdf_link}")
+                row = self.prepare_article_row(db, feed, entry, existing)
             except Exception as e:
-                logger.error(f"PDFリンク抽出中にエラーが発生しました: {e}")
+                logger.error(f"Error preparing article: {e}")
+                continue
+            if row:
+                rows.append(row)
+                # 同じフィード内の重複エントリも既存記事として扱う
+                existing.setdefault(row['link'], set()).add(row['guid'])
 
-            # Create summary immediately after saving
-            logger.info(f"Creating summary for new article: {title}")
-            summary = self.summarizer.create_ochiai_summary(article)
-            article.summary = summary
-            article.is_summarized = True
-            
-            db.commit()
-            logger.info(f"Saved new article with summary: {title}")
-            
-            return article
+        if not rows:
+            return []
 
+        try:
+            # 記事ごとのINSERTを1回の複数行INSERTにまとめる（他フィードと重複するlink/guidは無視）
+            result = db.execute(
+                pg_insert(Article).on_conflict_do_nothing().returning(Article.id),
+                rows,
+            )
+            article_ids = [row.id for row in result]
+            db.commit()
         except Exception as e:
             db.rollback()
-            logger.error(f"Error saving article: {e}")
-            return None
+            logger.error(f"Error saving articles: {e}")
+            return []
+
+        # PDFリンク抽出と要約は時間がかかるので、取得処理を待たせずワーカースレッドで行う
+        self.enqueue_article_processing(article_ids)
+
+        return article_ids
+
+    def fetch_new_feed(self, feed_id: int, url: str, limit: int) -> List[int]:
+        """Fetch and save the latest entries of a newly added feed (uses its own DB session)"""
+        # ダウンロード中はDB接続を掴まない
+        feed_data = self.fetch_feed(url)
+        if not feed_data:
+            return []
+        with session_scope() as db:
+            feed = db.get(RSSFeed, feed_id)
+            if not feed:
+                return []
+            return self.save_articles(db, feed, feed_data.entries[:limit])
+
+    def enqueue_article_processing(self, article_ids: List[int]) -> int:
+        """Queue articles for PDF link extraction and summarization (returns how many were newly queued)"""
+        with self._workers_lock:
+            if not self._workers:
+                self._workers = [
+                    threading.Thread(target=self._article_worker, name=f"article-worker-{i}", daemon=True)
+                    for i in range(settings.summary_workers)
+                ]
+                for worker in self._workers:
+                    worker.start()
+            new_ids = [article_id for article_id in article_ids if article_id not in self._queued_ids]
+            self._queued_ids.update(new_ids)
+        for article_id in new_ids:
+            self._article_queue.put(article_id)
+        return len(new_ids)
+
+    def enqueue_unsummarized_articles(self) -> int:
+        """Re-queue articles left unsummarized (e.g. queued or in progress when the process stopped)"""
+        with session_scope() as db:
+            article_ids = [
+                article_id for (article_id,) in
+                db.query(Article.id).filter(Article.is_summarized == False).order_by(Article.id)
+            ]
+        if not article_ids:
+            return 0
+        queued = self.enqueue_article_processing(article_ids)
+        if queued:
+            logger.info(f"Queued {queued} unsummarized articles")
+        return queued
+
+    def stop_workers(self) -> None:
+        """Drop queued articles and wait for the workers to finish the article in progress"""
+        # 未処理のIDは捨てる（is_summarized=Falseのまま残るので次回起動時に積み直される）
+        while True:
+            try:
+                article_id = self._article_queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._workers_lock:
+                self._queued_ids.discard(article_id)
+            self._article_queue.task_done()
+
+        with self._workers_lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._article_queue.put(None)
+        for worker in workers:
+            worker.join(timeout=_WORKER_STOP_TIMEOUT)
+            if worker.is_alive():
+                logger.warning(f"{worker.name} did not finish within {_WORKER_STOP_TIMEOUT} seconds")
+
+    def _article_worker(self):
+        """Worker thread that processes queued article IDs with its own DB session"""
+        while True:
+            article_id = self._article_queue.get()
+            # Noneは停止の合図
+            if article_id is None:
+                self._article_queue.task_done()
+                return
+            try:
+                self.process_new_article(article_id)
+            except Exception as e:
+                logger.error(f"Error processing article {article_id}: {e}")
+            finally:
+                with self._workers_lock:
+                    self._queued_ids.discard(article_id)
+                self._article_queue.task_done()
+
+    def process_new_article(self, article_id: int):
+        """Extract the PDF link and create the summary for a saved article"""
+        # 必要な列だけを短いセッションで確保して読み、PDFリンク抽出やLLM呼び出しの間は接続を掴まない
+        # （一括要約など他の処理が確保中・要約済みの記事は何もしない）
+        with session_scope() as db:
+            claimed = self.summarizer.claim_unsummarized_articles(db, [article_id], limit=1)
+            if not claimed:
+                return
+            article = claimed[0]
+
+            # 別フィードで同じ内容の記事が要約済みなら、LLMを呼ばずにその要約を流用する（失敗した要約は流用しない）
+            duplicate = None
+            if article.content_hash:
+                duplicate = db.query(
+                    Article.id, Article.summary, *(getattr(Article, field) for field in _SUMMARY_SECTION_FIELDS)
+                ).filter(
+                    Article.content_hash == article.content_hash,
+                    Article.id != article.id,
+                    Article.is_summarized == True,
+                    ~Article.summary.startswith(_SUMMARY_FAILURE_PREFIX),
+                ).first()
+
+        values = {'is_summarized': True, 'summary_claimed_at': None}
+
+        # PDFリンクを抽出
+        try:
+            pdf_link = self.extract_pdf_link(article.link)
+            if pdf_link:
+                values['pdf_link'] = pdf_link
+                logger.info(f"PDFリンクを保存しました: {pdf_link}")
+        except Exception as e:
+            logger.error(f"PDFリンク抽出中にエラーが発生しました: {e}")
+
+        if duplicate:
+            logger.info(f"Reusing summary of duplicate article {duplicate.id}: {article.title}")
+            values['summary'] = duplicate.summary
+            for field in _SUMMARY_SECTION_FIELDS:
+                values[field] = getattr(duplicate, field)
+        else:
+            logger.info(f"Creating summary for new article: {article.title}")
+            values['summary'] = self.summarizer.create_ochiai_summary(article)
+            # 要約器がセクションと埋め込みを設定した列だけを書き戻す
+            for field in (*_SUMMARY_SECTION_FIELDS, 'description_embedding'):
+                if hasattr(article, field):
+                    values[field] = getattr(article, field)
+
+        # 結果は別の短いセッションで書き戻す
+        with session_scope() as db:
+            db.execute(update(Article).where(Article.id == article.id).values(**values))
+        self.summarizer.semantic_cache.add(article.id, values.get('description_embedding'), values['summary'])
+        logger.info(f"Saved new article with summary: {article.title}")
 
     def fetch_all_feeds(self):
         """Fetch all active RSS feeds and save new articles"""
-        db = next(get_db())
         try:
-            feeds = db.query(RSSFeed).filter(RSSFeed.is_active == True).all()
+            # 取得対象の情報だけを読んでセッションを閉じる（ダウンロード中はDB接続を掴まない）
+            with session_scope() as db:
+                feeds = db.query(
+                    RSSFeed.id, RSSFeed.title, RSSFeed.url, RSSFeed.etag, RSSFeed.last_modified
+                ).filter(RSSFeed.is_active == True).all()
             
-            total_new_articles = 0
+            # フィードの取得はネットワーク待ちが大半なので並行して行う
             for feed in feeds:
                 logger.info(f"Fetching feed: {feed.title} ({feed.url})")
-                
-                feed_data = self.fetch_feed(feed.url)
-                if not feed_data:
-                    continue
-
-                # Update feed info if available
-                if hasattr(feed_data.feed, 'title') and feed_data.feed.title:
-                    feed.title = feed_data.feed.title
-                if hasattr(feed_data.feed, 'description') and feed_data.feed.description:
-                    feed.description = feed_data.feed.description
-
-                # Process entries
-                new_articles_count = 0
-                for entry in feed_data.entries:
-                    article = self.save_article(db, feed, entry)
-                    if article:
-                        new_articles_count += 1
-
-                total_new_articles += new_articles_count
-                logger.info(f"Added {new_articles_count} new articles from {feed.title}")
+            with ThreadPoolExecutor(max_workers=settings.feed_fetch_workers) as executor:
+                feed_results = list(executor.map(
+                    self.fetch_feed,
+                    [feed.url for feed in feeds],
+                    [feed.etag for feed in feeds],
+                    [feed.last_modified for feed in feeds],
+                ))
+            fetched = {feed.id: feed_data for feed, feed_data in zip(feeds, feed_results) if feed_data}
+            
+            total_new_articles = 0
+            # 取得できたフィードだけを新しいセッションで更新し、記事を保存する
+            with session_scope() as db:
+                for feed in db.query(RSSFeed).filter(RSSFeed.id.in_(fetched)).order_by(RSSFeed.id).all():
+                    feed_data = fetched[feed.id]
+
+                    # 次回の条件付きGETのためにETag/Last-Modifiedを保存する
+                    feed.etag = feed_data.get('etag')
+                    feed.last_modified = feed_data.get('modified')
+
+                    # Update feed info if available
+                    feed_title = getattr(feed_data.feed, 'title', None)
+                    if feed_title:
+                        feed.title = feed_title
+                    feed_description = getattr(feed_data.feed, 'description', None)
+                    if feed_description:
+                        feed.description = feed_description
+
+                    # Process entries
+                    new_articles_count = len(self.save_articles(db, feed, feed_data.entries))
+
+                    total_new_articles += new_articles_count
+                    logger.info(f"Added {new_articles_count} new articles from {feed.title}")
 
-            db.commit()
             logger.info(f"Total new articles added: {total_new_articles}")
             return total_new_articles
 
         except Exception as e:
-            db.rollback()
             logger.error(f"Error in fetch_all_feeds: {e}")
             return 0
-        finally:
-            db.close()
 
 
 if __name__ == "__main__":
@@ -1,14 +1,14 @@
-import schedule
 import time
-import threading
-from datetime import datetime, timedelta
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta, timezone
 import logging
 from rss_fetcher import RSSFetcher
 from summarizer import ArticleSummarizer
 from email_sender import EmailSender
 from config import settings
-from database import get_db, Article
-from sqlalchemy.orm import Session
+from database import session_scope, Article, JST
 from sqlalchemy import and_
 
 logging.basicConfig(level=logging.INFO)
@@ -17,15 +17,19 @@ logger = logging.getLogger(__name__)
 
 class TaskScheduler:
     def __init__(self):
-        self.rss_fetcher = RSSFetcher()
         self.summarizer = ArticleSummarizer()
+        # 要約器（OpenAIクライアントと接続プール）はフェッチャーと共有する
+        self.rss_fetcher = RSSFetcher(summarizer=self.summarizer)
         self.email_sender = EmailSender()
-        self.running = False
+        # ジョブは実行時刻にだけ起動する（毎分起きて時刻を照合しない）
+        self.scheduler = BackgroundScheduler(timezone=JST)
 
     def fetch_rss_job(self):
         """Job to fetch RSS feeds"""
         logger.info("Starting RSS fetch job")
         try:
+            # 前回の停止・再起動で処理されずに残った記事をワーカーに積み直す
+            self.rss_fetcher.enqueue_unsummarized_articles()
             new_articles = self.rss_fetcher.fetch_all_feeds()
             logger.info(f"RSS fetch job completed. New articles: {new_articles}")
         except Exception as e:
@@ -56,17 +60,16 @@ class TaskScheduler:
         days = settings.cleanup_read_articles_days
         logger.info(f"Starting cleanup of read articles older than {days} days")
         try:
-            db: Session = next(get_db())
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            deleted = db.query(Article).filter(
-                and_(
-                    Article.is_read == True,
-                    Article.read_at != None,
-                    Article.read_at < cutoff_date,
-                    Article.is_favorite == False
-                )
-            ).delete(synchronize_session=False)
-            db.commit()
+            with session_scope() as db:
+                cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
+                deleted = db.query(Article).filter(
+                    and_(
+                        Article.is_read == True,
+                        Article.read_at != None,
+                        Article.read_at < cutoff_date,
+                        Article.is_favorite == False
+                    )
+                ).delete(synchronize_session=False)
             logger.info(f"Deleted {deleted} read articles older than {days} days")
         except Exception as e:
             logger.error(f"Error in cleanup_read_articles_job: {e}")
@@ -76,75 +79,42 @@ class TaskScheduler:
         limit = settings.cleanup_unread_articles_limit
         logger.info(f"Starting cleanup of unread articles if over limit of {limit}")
         try:
-            db: Session = next(get_db())
-            unread_count = db.query(Article).filter(
-                and_(Article.is_read == False, Article.is_favorite == False)
-            ).count()
-            if unread_count > limit:
-                to_delete = unread_count - limit
-                old_unread = db.query(Article).filter(
+            with session_scope() as db:
+                # 新しい順に上限件数を残し、それより古い未読記事を1回のDELETEで削除する（件数の事前COUNTは不要）
+                old_unread = db.query(Article.id).filter(
                     and_(Article.is_read == False, Article.is_favorite == False)
-                ).order_by(Article.published_at.asc()).limit(to_delete).all()
-                ids = [a.id for a in old_unread]
+                ).order_by(Article.published_date.desc()).offset(limit).scalar_subquery()
                 deleted = db.query(Article).filter(
-                    Article.id.in_(ids)
+                    Article.id.in_(old_unread)
                 ).delete(synchronize_session=False)
-                db.commit()
-                logger.info(f"Deleted {deleted} old unread articles to keep under {limit}")
+            logger.info(f"Deleted {deleted} old unread articles to keep under {limit}")
         except Exception as e:
             logger.error(f"Error in cleanup_unread_articles_job: {e}")
 
     def setup_schedules(self):
         """Setup scheduled jobs"""
-        # Parse cron-like schedule for RSS fetching (simplified)
-        # For now, we'll use simple schedule library syntax
-        # RSS fetch every 6 hours
-        schedule.every(settings.rss_fetch_interval_hour).hours.do(self.fetch_rss_job)
-        
-        # Summary email every day at configured time (JST)
-        import pytz
-
-        def run_summary_email_jst():
-            jst = pytz.timezone('Asia/Tokyo')
-            now_jst = datetime.now(jst)
-            if now_jst.hour == settings.summary_email_hour and now_jst.minute == settings.summary_email_minute:
-                self.send_summary_email_job()
-        schedule.every().minute.do(run_summary_email_jst)
-
-        def run_cleanup_read_articles_jst():
-            jst = pytz.timezone('Asia/Tokyo')
-            now_jst = datetime.now(jst)
-            if now_jst.hour == settings.cleanup_read_articles_hour and now_jst.minute == settings.cleanup_read_articles_minute:
-                self.cleanup_read_articles_job()
-        schedule.every().minute.do(run_cleanup_read_articles_jst)
-
-        def run_cleanup_unread_articles_jst():
-            jst = pytz.timezone('Asia/Tokyo')
-            now_jst = datetime.now(jst)
-            if now_jst.hour == settings.cleanup_unread_articles_hour and now_jst.minute == settings.cleanup_unread_articles_minute:
-                self.cleanup_unread_articles_job()
-        schedule.every().minute.do(run_cleanup_unread_articles_jst)
+        # RSS fetch every N hours
+        self.scheduler.add_job(
+            self.fetch_rss_job,
+            IntervalTrigger(hours=settings.rss_fetch_interval_hour),
+            id="fetch_rss_job",
+        )
+
+        # Summary email / cleanup jobs every day at configured times (JST)
+        daily_jobs = [
+            (settings.summary_email_hour, settings.summary_email_minute, self.send_summary_email_job),
+            (settings.cleanup_read_articles_hour, settings.cleanup_read_articles_minute, self.cleanup_read_articles_job),
+            (settings.cleanup_unread_articles_hour, settings.cleanup_unread_articles_minute, self.cleanup_unread_articles_job),
+        ]
+        for hour, minute, job in daily_jobs:
+            self.scheduler.add_job(job, CronTrigger(hour=hour, minute=minute, timezone=JST), id=job.__name__)
 
         logger.info("Scheduled jobs configured:")
-        logger.info("- RSS fetch: Every 6 hours")
+        logger.info(f"- RSS fetch: Every {settings.rss_fetch_interval_hour} hours")
         logger.info(f"- Summary email: Daily at {settings.summary_email_hour}:{settings.summary_email_minute:02d} JST")
         logger.info(f"- Cleanup read articles: Daily at {settings.cleanup_read_articles_hour}:{settings.cleanup_read_articles_minute:02d} JST")
         logger.info(f"- Cleanup unread articles: Daily at {settings.cleanup_unread_articles_hour}:{settings.cleanup_unread_articles_minute:02d} JST")
 
-    def run_scheduler(self):
-        """Run the scheduler in a separate thread"""
-        self.running = True
-        logger.info("Scheduler started")
-        
-        check_interval = settings.scheduler_check_interval
-        while self.running:
-            try:
-                schedule.run_pending()
-                time.sleep(check_interval)  # Check at configured interval
-            except Exception as e:
-                logger.error(f"Error in scheduler: {e}")
-                time.sleep(check_interval)
-
     def start(self):
         """Start the scheduler"""
         self.setup_schedules()
@@ -153,15 +123,18 @@ class TaskScheduler:
         logger.info("Running initial RSS fetch...")
         self.fetch_rss_job()
         
-        # Start scheduler in background thread
-        scheduler_thread = threading.Thread(target=self.run_scheduler, daemon=True)
-        scheduler_thread.start()
-        
-        return scheduler_thread
+        # Start scheduler (runs in its own background thread)
+        self.scheduler.start()
+        logger.info("Scheduler started")
 
     def stop(self):
         """Stop the scheduler"""
-        self.running = False
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        # 記事処理ワーカーを止めてから接続を閉じる
+        self.rss_fetcher.stop_workers()
+        self.rss_fetcher.close()
+        self.email_sender.close()
         logger.info("Scheduler stopped")
 
     def run_manual_fetch(self):
@@ -177,12 +150,18 @@ class TaskScheduler:
     def get_schedule_info(self):
         """Get information about scheduled jobs"""
         jobs = []
-        for job in schedule.jobs:
+        for job in self.scheduler.get_jobs():
+            # 開始前のジョブにはnext_run_timeがまだない
+            next_run = getattr(job, 'next_run_time', None)
+            if isinstance(job.trigger, IntervalTrigger):
+                interval, unit = int(job.trigger.interval.total_seconds() // 3600), 'hours'
+            else:
+                interval, unit = 1, 'days'
             jobs.append({
-                'job': str(job.job_func.__name__),
-                'next_run': job.next_run.strftime('%Y-%m-%d %H:%M:%S') if job.next_run else 'Not scheduled',
-                'interval': str(job.interval),
-                'unit': job.unit
+                'job': job.func.__name__,
+                'next_run': next_run.strftime('%Y-%m-%d %H:%M:%S') if next_run else 'Not scheduled',
+                'interval': str(interval),
+                'unit': unit
             })
         return jobs
 
@@ -192,7 +171,7 @@ if __name__ == "__main__":
     
     try:
         # Start scheduler
-        thread = scheduler.start()
+        scheduler.start()
         
         print("Scheduler is running. Press Ctrl+C to stop.")
         
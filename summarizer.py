@@ -1,30 +1,35 @@
+import httpx
 import openai
 from typing import List, Optional, Dict, Any, Tuple
+from sqlalchemy import or_, select, update
 from sqlalchemy.orm import Session, joinedload
-from database import get_db, Article
+from database import session_scope, Article, get_jst_now
 from config import settings
 import logging
-from datetime import datetime
+import math
+import re
+import threading
+import numpy as np
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import requests
+from functools import lru_cache
 import tempfile
 import os
 
+try:
+    import tiktoken
+except ImportError:  # 未インストールの場合は文字数での切り詰めのみ行う
+    tiktoken = None
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_SYSTEM_PROMPT = "あなたは研究論文や技術記事の要約を専門とするAIアシスタントです。落合フォーマットに従って、正確な要約を作成してください。"
 
-class ArticleSummarizer:
-    def __init__(self):
-        openai.api_key = settings.openai_api_key
-        self.client = openai.OpenAI(api_key=settings.openai_api_key)
-
-    def create_ochiai_summary(self, article: Article) -> str:
-        """
-        Create summary using Ochiai format (落合フォーマット) and parse into sections
-        """
-        prompt = f"""
-以下の記事を落合フォーマットで要約してください。落合フォーマットは以下の6つの観点で構成されます：
+_OCHIAI_INSTRUCTIONS = """以下の記事を落合フォーマットで要約してください。落合フォーマットは以下の6つの観点で構成されます：
 
 1. どんなもの？
 2. 先行研究と比べてどこがすごい？
@@ -33,31 +38,185 @@ class ArticleSummarizer:
 5. 議論はある？
 6. 次読むべき論文は？
 
-記事情報：
-タイトル: {article.title}
-URL: {article.link}
-
-内容:
-{article.description[: settings.article_description_limit]}  # Limit content to avoid token limits
-
 要約は日本語で、各観点について簡潔にまとめてください。技術的な内容の場合は専門用語も適切に使用して。
 必ず各セクションを「1. どんなもの？」のように番号付きで明確に区切って。あと書き言葉で書いて。
 """
 
+# 指示文を変更したらキーも更新する
+_PROMPT_CACHE_KEY = "ochiai-v1"
+
+_SUMMARY_FAILURE_PREFIX = "要約の生成に失敗しました"
+
+# 未要約記事を一度に確保する件数
+_SUMMARY_FETCH_BATCH = 100
+
+# 確保したまま処理が終わらなかった記事（プロセスの異常終了など）を再び確保できるまでの時間
+_SUMMARY_CLAIM_LEASE = timedelta(minutes=30)
+
+# 各セクションの見出し（「1. どんなもの？」や「**1. どんなもの？**」）。見出し番号がフィールドに対応する
+# 改行せずに1行で返ってくる回答もあるため、行頭だけでなく空白の直後の見出しも区切りとみなす
+_OCHIAI_FIELDS = ("top_summary", "comparison", "technique", "validation", "discussion", "next_papers")
+_OCHIAI_HEADER_RE = re.compile(
+    r"(?m)(?:^|(?<=\s))[ \t#*>-]*([1-6])\.\s*"
+    r"(?:どんなもの|先行研究と比べて|技術や手法の|どうやって有効|議論は|次読むべき)[^？?\n]*[？?]?[ \t*]*"
+)
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """Tokenizer for the configured model (None when tiktoken or its encoding files are unavailable)"""
+    if tiktoken is None:
+        return None
+    try:
         try:
-            response = self.client.chat.completions.create(
-                model=settings.gpt_model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "あなたは研究論文や技術記事の要約を専門とするAIアシスタントです。落合フォーマットに従って、正確な要約を作成してください。",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=settings.openai_temperature,
-            )
+            return tiktoken.encoding_for_model(settings.gpt_model)
+        except KeyError:
+            # tiktokenが知らないモデル名は最新のエンコーディングで近似する
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, truncating descriptions by characters only: {e}")
+        return None
+
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens (日本語は1文字≒1トークンなので文字数では上限が読めない)"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+class SemanticSummaryCache:
+    """
+    Reuse the summary of an already summarized article whose description embedding is nearly identical
+    (the same paper republished by arXiv mirrors and aggregators)
+    """
+
+    def __init__(self, client: openai.OpenAI):
+        self.client = client
+        # 直近の要約済み記事の正規化済み埋め込み（初回の検索時に一度だけDBから読み、以降は保存時に追記する）
+        self._lock = threading.Lock()
+        self._ids: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._next = 0
+
+    def embed(self, description: Optional[str]) -> Optional[List[float]]:
+        """Embed the head of the description (does not touch the DB, safe to call from threads)"""
+        if not settings.semantic_cache_enabled:
+            return None
+        text = (description or "").strip()[: settings.embedding_input_limit]
+        # 短い説明文は定型文同士が一致してしまうため対象外
+        if len(text) < settings.semantic_cache_min_chars:
+            return None
+        try:
+            response = self.client.embeddings.create(model=settings.embedding_model, input=text)
+        except Exception as e:
+            logger.error(f"Error creating description embedding: {e}")
+            return None
+        embedding = response.data[0].embedding
+        # 正規化しておけば内積がそのままコサイン類似度になる
+        norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+        return [x / norm for x in embedding]
+
+    def _load(self, db: Session, dimensions: int) -> None:
+        """Read the embeddings of the most recent summarized articles into the matrix (called once, under the lock)"""
+        rows = db.query(Article.id, Article.description_embedding).filter(
+            Article.is_summarized == True,
+            Article.description_embedding.isnot(None),
+            ~Article.summary.startswith(_SUMMARY_FAILURE_PREFIX),
+        ).order_by(Article.id.desc()).limit(settings.semantic_cache_candidates).all()
+
+        # 件数の上限までを環状バッファとして確保し、古いものから上書きする（-1は空き）
+        self._ids = np.full(settings.semantic_cache_candidates, -1, dtype=np.int64)
+        self._matrix = np.zeros((settings.semantic_cache_candidates, dimensions), dtype=np.float32)
+        self._next = 0
+        for article_id, candidate in reversed(rows):
+            if len(candidate) == dimensions:
+                self._append(article_id, candidate)
+
+    def _append(self, article_id: int, embedding: List[float]) -> None:
+        slot = self._next % len(self._ids)
+        self._ids[slot] = article_id
+        self._matrix[slot] = embedding
+        self._next += 1
+
+    def add(self, article_id: int, embedding: Optional[List[float]], summary: Optional[str]) -> None:
+        """Make a newly saved summary available to later lookups"""
+        if embedding is None or not summary or summary.startswith(_SUMMARY_FAILURE_PREFIX):
+            return
+        with self._lock:
+            # 未読み込みなら初回の検索時にDBから読まれる
+            if self._matrix is not None and len(embedding) == self._matrix.shape[1]:
+                self._append(article_id, embedding)
+
+    def query(self, db: Session, embedding: List[float], exclude_id: Optional[int] = None) -> Optional[Tuple[int, str, float]]:
+        """Return (article id, summary, score) of the most similar summarized article above the threshold"""
+        if settings.semantic_cache_candidates <= 0:
+            return None
+        with self._lock:
+            if self._matrix is None:
+                self._load(db, len(embedding))
+            if len(embedding) != self._matrix.shape[1]:
+                return None
+            # 正規化済みなので内積がコサイン類似度になる
+            scores = self._matrix @ np.asarray(embedding, dtype=np.float32)
+            scores[self._ids == -1] = -np.inf
+            if exclude_id is not None:
+                scores[self._ids == exclude_id] = -np.inf
+            best = int(np.argmax(scores))
+            article_id, score = int(self._ids[best]), float(scores[best])
+        if score < settings.semantic_cache_threshold:
+            return None
+
+        # 要約本文はヒットした1件だけDBから読む（削除・再要約された記事は使わない）
+        summary = db.query(Article.summary).filter(
+            Article.id == article_id,
+            Article.is_summarized == True,
+            ~Article.summary.startswith(_SUMMARY_FAILURE_PREFIX),
+        ).scalar()
+        if summary is None:
+            return None
+        return article_id, summary, score
 
-            summary = response.choices[0].message.content.strip()
+
+
+class ArticleSummarizer:
+    def __init__(self):
+        openai.api_key = settings.openai_api_key
+        # 要約ワーカー間でAPIへの接続を使い回す（呼び出しごとのTLSハンドシェイクを避ける）
+        self._http = httpx.Client(
+            timeout=openai.DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+        )
+        # 429・タイムアウト・接続エラー・5xxはSDKが指数バックオフ（Retry-After優先）で再試行する
+        self.client = openai.OpenAI(
+            api_key=settings.openai_api_key,
+            max_retries=settings.openai_max_retries,
+            http_client=self._http,
+        )
+        self.semantic_cache = SemanticSummaryCache(self.client)
+
+    def close(self) -> None:
+        """Close the pooled API connections"""
+        self._http.close()
+
+    def create_ochiai_summary(self, article: Article) -> str:
+        """
+        Create summary using Ochiai format (落合フォーマット) and parse into sections
+        (article may be a detached row; the DB is only used briefly for the semantic cache lookup)
+        """
+        try:
+            embedding = self.semantic_cache.embed(article.description)
+            if embedding is not None:
+                with session_scope() as db:
+                    cached = self._lookup_semantic_cache(article, embedding, db)
+                if cached is not None:
+                    return cached
+
+            summary = self.generate_ochiai_summary(article.title, article.link, article.description)
 
             # 各セクションを分割して保存
             self._parse_and_save_sections(article, summary)
@@ -66,76 +225,163 @@ URL: {article.link}
 
         except Exception as e:
             logger.error(f"Error creating summary for article {article.id}: {e}")
-            return f"要約の生成に失敗しました: {str(e)}"
+            return f"{_SUMMARY_FAILURE_PREFIX}: {str(e)}"
+
+    def _lookup_semantic_cache(self, article: Article, embedding: Optional[List[float]], db: Session) -> Optional[str]:
+        """
+        Store the embedding on the article and, on a cache hit, fill its sections from the cached summary
+        """
+        if embedding is None:
+            return None
+        article.description_embedding = embedding
+        hit = self.semantic_cache.query(db, embedding, exclude_id=article.id)
+        if hit is None:
+            return None
+        article_id, summary, score = hit
+        logger.info(f"Reusing summary of similar article {article_id} (score={score:.3f}): {article.title}")
+        self._parse_and_save_sections(article, summary)
+        return summary
+
+    def generate_ochiai_summary(self, title: str, link: str, description: str) -> str:
+        """
+        Request an Ochiai format summary from the API (does not touch the DB, safe to call from threads)
+        """
+        # 全記事で共通の指示を先頭に置き、記事ごとに変わる情報は末尾に回す（プロンプトキャッシュが効くように）
+        prompt = f"""{_OCHIAI_INSTRUCTIONS}
+記事情報：
+タイトル: {title}
+URL: {link}
+
+内容:
+{_truncate_tokens(description[: settings.article_description_limit], settings.article_description_max_tokens)}
+"""
+
+        response = self.client.chat.completions.create(
+            model=settings.gpt_model,
+            messages=[
+                {"role": "system", "content": _SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=settings.openai_temperature,
+            # 共通プレフィックスのキャッシュを同じキーのリクエスト間で共有する
+            extra_body={"prompt_cache_key": _PROMPT_CACHE_KEY},
+        )
+
+        return response.choices[0].message.content.strip()
 
     def _parse_and_save_sections(self, article: Article, summary: str) -> None:
         """
         Parse the Ochiai format summary into separate sections and save to article
         """
         try:
-            # 正規表現パターンを定義
-            import re
-
-            # 各セクションのパターン
-            patterns = {
-                "top_summary": r"1\.\s*どんなもの？\s*(.*?)(?=2\.\s*先行研究|$)",
-                "comparison": r"2\.\s*先行研究と比べてどこがすごい？\s*(.*?)(?=3\.\s*技術や手法|$)",
-                "technique": r"3\.\s*技術や手法のキモはどこ？\s*(.*?)(?=4\.\s*どうやって有効|$)",
-                "validation": r"4\.\s*どうやって有効だと検証した？\s*(.*?)(?=5\.\s*議論|$)",
-                "discussion": r"5\.\s*議論はある？\s*(.*?)(?=6\.\s*次読むべき|$)",
-                "next_papers": r"6\.\s*次読むべき論文は？\s*(.*?)(?=$)",
-            }
-
-            # 各セクションを抽出して保存
-            for field, pattern in patterns.items():
-                match = re.search(pattern, summary, re.DOTALL)
-                if match:
-                    content = match.group(1).strip()
-                    setattr(article, field, content)
-                else:
-                    # マッチしない場合は空文字列を設定
-                    setattr(article, field, "")
+            # 見出しで一度だけ分割する: [前置き, "1", 本文1, "2", 本文2, ...]
+            parts = _OCHIAI_HEADER_RE.split(summary)
+            sections = {}
+            for number, body in zip(parts[1::2], parts[2::2]):
+                sections.setdefault(int(number), body.strip())
+
+            # 見出しが見つからないセクションは空文字列を設定
+            for number, field in enumerate(_OCHIAI_FIELDS, start=1):
+                setattr(article, field, sections.get(number, ""))
 
         except Exception as e:
             logger.error(
                 f"Error parsing summary sections for article {article.id}: {e}"
             )
 
+    def claim_unsummarized_articles(
+        self, db: Session, article_ids: Optional[List[int]] = None, limit: int = _SUMMARY_FETCH_BATCH
+    ) -> List[SimpleNamespace]:
+        """
+        Mark up to `limit` unsummarized articles as claimed and return the columns needed to summarize them
+        (articles claimed by another worker within the lease are skipped, so each one is sent to the API once)
+        """
+        now = get_jst_now()
+        conditions = [
+            Article.is_summarized == False,
+            or_(Article.summary_claimed_at.is_(None), Article.summary_claimed_at < now - _SUMMARY_CLAIM_LEASE),
+        ]
+        if article_ids is not None:
+            conditions.append(Article.id.in_(article_ids))
+        # 他のトランザクションがロック中の行は待たずに飛ばす
+        candidates = (
+            select(Article.id).where(*conditions).order_by(Article.id).limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.execute(
+            update(Article)
+            .where(Article.id.in_(candidates))
+            .values(summary_claimed_at=now)
+            .returning(Article.id, Article.title, Article.link, Article.description, Article.content_hash)
+            .execution_options(synchronize_session=False)
+        )
+        return [SimpleNamespace(**row._asdict()) for row in rows]
+
     def summarize_unsummarized_articles(self) -> int:
         """Summarize all articles that don't have summaries yet"""
-        db = next(get_db())
         try:
-            # Get all unsummarized articles
-            articles = db.query(Article).filter(Article.is_summarized == False).all()
+            # API呼び出しはネットワーク待ちが大半なので複数件を並行して行う（DBの更新はこのスレッドだけで行う）
+            summarized_count = 0
+            with ThreadPoolExecutor(max_workers=settings.summary_workers) as executor:
+                while True:
+                    # 短いトランザクションで少しずつ確保する（記事処理ワーカーと同じ記事を要約しない）
+                    with session_scope() as db:
+                        articles = self.claim_unsummarized_articles(db)
+                    if not articles:
+                        break
+
+                    # 先に埋め込みを求め、近似重複が要約済みの記事はAPIで要約しない
+                    embeddings = list(executor.map(self.semantic_cache.embed, (article.description for article in articles)))
+                    with session_scope() as db:
+                        cached = [
+                            self._lookup_semantic_cache(article, embedding, db)
+                            for article, embedding in zip(articles, embeddings)
+                        ]
+                    futures = [
+                        None if hit is not None else
+                        executor.submit(self.generate_ochiai_summary, article.title, article.link, article.description)
+                        for article, hit in zip(articles, cached)
+                    ]
+                    for article, hit, future in zip(articles, cached, futures):
+                        try:
+                            if hit is not None:
+                                summary = hit
+                            else:
+                                summary = future.result()
+                                self._parse_and_save_sections(article, summary)
+                        except Exception as e:
+                            logger.error(f"Error creating summary for article {article.id}: {e}")
+                            summary = f"{_SUMMARY_FAILURE_PREFIX}: {str(e)}"
+                        article.summary = summary
+                        article.is_summarized = True
+                        article.summary_claimed_at = None
+                        summarized_count += 1
+                        logger.info(
+                            f"Created summary for article {article.id}: {article.title}"
+                        )
 
-            if not articles:
+                    # 主キー指定のUPDATEをまとめて実行する（読み込んだ列は書き戻さない）
+                    with session_scope() as db:
+                        db.execute(update(Article), [
+                            {
+                                key: value for key, value in vars(article).items()
+                                if key not in ("title", "link", "description", "content_hash")
+                            }
+                            for article in articles
+                        ])
+                    for article in articles:
+                        self.semantic_cache.add(article.id, getattr(article, "description_embedding", None), article.summary)
+
+            if not summarized_count:
                 logger.info("No unsummarized articles found")
                 return 0
 
-            summarized_count = 0
-            for article in articles:
-                try:
-                    summary = self.create_ochiai_summary(article)
-                    article.summary = summary
-                    article.is_summarized = True
-                    summarized_count += 1
-                    logger.info(
-                        f"Created summary for article {article.id}: {article.title}"
-                    )
-                except Exception as e:
-                    logger.error(f"Error summarizing article {article.id}: {e}")
-                    continue
-
-            db.commit()
             logger.info(f"Successfully summarized {summarized_count} articles")
             return summarized_count
 
         except Exception as e:
-            db.rollback()
             logger.error(f"Error in summarize_unsummarized_articles: {e}")
             return 0
-        finally:
-            db.close()
 
 
 if __name__ == "__main__":
@@ -1,35 +1,216 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Form, Body, Response, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Request, Form, Body, Response, status
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, and_, or_
-from database import get_db, Article, RSSFeed, EmailLog, get_jst_now
-from rss_fetcher import RSSFetcher
-from summarizer import ArticleSummarizer
-from email_sender import EmailSender
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy.orm import Session, load_only, selectinload, raiseload
+from sqlalchemy import desc, and_, or_, func, lambda_stmt, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import get_db, SessionLocal, Article, RSSFeed, EmailLog, get_jst_now
 from scheduler import TaskScheduler
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+from jinja2 import FileSystemBytecodeCache
 import logging
 import json
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+import time
 from config import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="RSS Summarizer", description="RSS記事要約システム")
+# JSONのAPIはorjson（C実装）でシリアライズする
+app = FastAPI(title="RSS Summarizer", description="RSS記事要約システム", default_response_class=ORJSONResponse)
 
-# Setup templates
-templates = Jinja2Templates(directory="templates")
+# 1KB以上のHTML/JSONは圧縮して返す（記事一覧のHTMLは繰り返しが多くよく縮む）
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
 
-# Initialize components
-rss_fetcher = RSSFetcher()
-summarizer = ArticleSummarizer()
-email_sender = EmailSender()
+# Setup templates
+# 本番ではテンプレートファイルの更新確認を省き、コンパイル結果を再起動後も使い回す
+_template_cache_dir = os.path.join(tempfile.gettempdir(), "rss_paper_server_jinja")
+os.makedirs(_template_cache_dir, exist_ok=True)
+templates = Jinja2Templates(
+    directory="templates",
+    auto_reload=settings.debug,
+    bytecode_cache=FileSystemBytecodeCache(_template_cache_dir),
+)
+
+# Initialize components (share the scheduler's clients and connection pools)
 scheduler = TaskScheduler()
+rss_fetcher = scheduler.rss_fetcher
+summarizer = scheduler.summarizer
+email_sender = scheduler.email_sender
+
+_STARTED_AT = time.time()
+
+# 件数などの集計結果をプロセス内で短時間キャッシュする（書き込み系のエンドポイントで破棄）
+_cache: Dict[str, Tuple[float, Any]] = {}
+_cache_lock = threading.Lock()
+# キーごとの再計算ロック（同時に期限切れを迎えたリクエストのうち1つだけがDBを集計する）
+_load_locks: Dict[str, threading.Lock] = {}
+# 破棄より前に始まった再計算の結果を書き戻さないための世代番号
+_cache_generation = 0
+
+
+def _cached(key: str, ttl: float, loader: Callable[[], Any]) -> Any:
+    """
+    Return the cached value for key, calling loader when it is missing or older than ttl seconds.
+    Only one thread reloads a key at a time; the others get the stale value, or wait if there is none.
+    """
+    with _cache_lock:
+        entry = _cache.get(key)
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    # 期限切れの値があれば、再計算中は待たずにそれを返す
+    if not load_lock.acquire(blocking=entry is None):
+        return entry[1]
+    try:
+        with _cache_lock:
+            entry = _cache.get(key)
+            generation = _cache_generation
+        # 待っている間に別のスレッドが再計算を終えていればそれを使う
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        value = loader()
+        with _cache_lock:
+            if generation == _cache_generation:
+                _cache[key] = (time.monotonic() + ttl, value)
+        return value
+    finally:
+        load_lock.release()
+
+
+def _invalidate_cache() -> None:
+    """Drop every cached value (call after writes)"""
+    global _cache_generation
+    with _cache_lock:
+        _cache.clear()
+        _cache_generation += 1
+
+
+# 複数記事の削除で1回のDELETEに含めるIDの数
+_DELETE_BATCH = 1000
+
+# 一覧表示用の読み込み方法: 一覧で表示する列だけを読み（要約本文などの大きな列は読まない）、
+# フィードはSELECT ... INでまとめて取得し、それ以外の遅延ロード（N+1）は例外にする
+_ARTICLE_LIST_OPTIONS = (
+    load_only(
+        Article.id, Article.title, Article.description, Article.author, Article.keywords,
+        Article.top_summary, Article.published_date, Article.created_at,
+        Article.is_read, Article.is_favorite, Article.is_summarized, Article.feed_id,
+        raiseload=True,
+    ),
+    selectinload(Article.feed),
+    raiseload("*"),
+)
+
+
+# 毎リクエスト実行する定型のクエリはlambda_stmtにして、SQLの組み立てとコンパイルをプロセスで1回にする
+# （ラムダ内で参照する引数はバインドパラメーターになる）
+def _recent_articles_stmt(limit: int):
+    return lambda_stmt(
+        lambda: select(Article).options(*_ARTICLE_LIST_OPTIONS).order_by(desc(Article.created_at)).limit(limit)
+    )
+
+
+def _mark_read_stmt(article_id: int, read_at: datetime):
+    # 更新前のis_readも返し、未読から既読に変わったかを判定できるようにする
+    def build():
+        previous = (
+            select(Article.id, Article.is_read.label("was_read"))
+            .where(Article.id == article_id)
+            .with_for_update()
+            .subquery()
+        )
+        return (
+            update(Article)
+            .where(Article.id == previous.c.id)
+            .values(is_read=True, read_at=read_at)
+            .returning(Article, previous.c.was_read)
+        )
+    return lambda_stmt(build)
+
+
+def _get_snapshot(db: Session) -> Dict[str, Any]:
+    """Counts, per-day article counts and a data version, cached together so they stay consistent"""
+    return _cached("snapshot", settings.stats_cache_ttl, lambda: _build_snapshot(db))
+
+
+def _build_snapshot(db: Session) -> Dict[str, Any]:
+    # 記事・フィードの件数と最終更新日時を1回の往復で求める（フィード側はスカラーサブクエリ）
+    total_articles, unread_articles, articles_updated, total_feeds, active_feeds, feeds_updated = db.query(
+        func.count(Article.id),
+        func.count(Article.id).filter(Article.is_read == False),
+        func.max(Article.updated_at),
+        select(func.count(RSSFeed.id)).scalar_subquery(),
+        select(func.count(RSSFeed.id).filter(RSSFeed.is_active == True)).scalar_subquery(),
+        select(func.max(RSSFeed.updated_at)).scalar_subquery(),
+    ).select_from(Article).one()
+
+    # Articles by day (for configured period)
+    days_period = settings.stats_days_period
+    # created_atはUTCの壁時計時刻で保存されている
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_period)
+    # 日ごとの件数はDB側で集計する（記事を1件ずつ読み込まない）
+    day = func.date(Article.created_at)
+    articles_by_day = {
+        d.isoformat(): count
+        for d, count in db.query(day, func.count(Article.id))
+        .filter(Article.created_at >= cutoff_date)
+        .group_by(day)
+        .order_by(day)
+    }
+
+    counts = {
+        'total_articles': total_articles,
+        'unread_articles': unread_articles,
+        'total_feeds': active_feeds,
+    }
+    # 削除は最終更新日時に現れないので件数も含める。再起動（テンプレート更新）でも変わるよう起動時刻も含める
+    version = hashlib.sha1(repr((
+        _STARTED_AT, counts, total_feeds, articles_updated, feeds_updated, articles_by_day,
+    )).encode()).hexdigest()
+    return {"counts": counts, "articles_by_day": articles_by_day, "version": version}
+
+
+def _get_data_version() -> str:
+    with SessionLocal() as db:
+        return _get_snapshot(db)["version"]
+
+
+# 読み取り専用のページはデータが変わっていなければ304を返す（DB検索とテンプレート描画を省く）
+_ETAG_PATHS = {"/", "/articles", "/feeds", "/api/stats"}
 
 
+@app.middleware("http")
+async def etag_middleware(request: Request, call_next):
+    if request.method != "GET" or request.url.path not in _ETAG_PATHS:
+        return await call_next(request)
+
+    version = await run_in_threadpool(_get_data_version)
+    # 同じURLでもHTMXの部分レスポンスとページ全体は別の表現として扱う
+    partial = _is_partial_request(request)
+    digest = hashlib.sha1(f"{version}:{partial}:{request.url.path}?{request.url.query}".encode()).hexdigest()
+    etag = f'W/"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={**headers, "Vary": "HX-Request"})
+
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+        # gzipが付けるVary: Accept-Encodingを上書きしない
+        response.headers.add_vary_header("HX-Request")
+    return response
+
 
 @app.on_event("startup")
 async def startup_event():
@@ -37,6 +218,10 @@ async def startup_event():
     from database import create_tables, SessionLocal
     create_tables()
     
+    # 最初のリクエストでコンパイルを待たせないよう、全テンプレートを起動時に読み込んでおく
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+    
     # Start scheduler
     scheduler.start()
     logger.info("Application started with scheduler")
@@ -51,22 +236,15 @@ async def shutdown_event():
 
 
 
+# SQLAlchemyの同期セッションを使うので、ハンドラーは通常の関数にしてスレッドプールで実行させる（イベントループを塞がない）
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, db: Session = Depends(get_db)):
+def home(request: Request, db: Session = Depends(get_db)):
     """Home page with article list"""
     # Get recent articles
-    articles = db.query(Article).order_by(desc(Article.created_at)).limit(settings.home_articles_limit).all()
+    articles = db.execute(_recent_articles_stmt(settings.home_articles_limit)).scalars().all()
     
     # Get statistics
-    total_articles = db.query(Article).count()
-    unread_articles = db.query(Article).filter(Article.is_read == False).count()
-    total_feeds = db.query(RSSFeed).filter(RSSFeed.is_active == True).count()
-    
-    stats = {
-        'total_articles': total_articles,
-        'unread_articles': unread_articles,
-        'total_feeds': total_feeds
-    }
+    stats = _get_snapshot(db)["counts"]
     
     return templates.TemplateResponse("home.html", {
         "request": request,
@@ -75,32 +253,84 @@ async def home(request: Request, db: Session = Depends(get_db)):
     })
 
 
+def _get_filter_options(db: Session) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Active feeds and unique article keywords for the filter dropdowns (cached)"""
+    return _cached("filter_options", settings.filter_options_cache_ttl, lambda: _build_filter_options(db))
+
+
+def _build_filter_options(db: Session) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    # セッションをまたいでキャッシュするのでORMオブジェクトではなくdictで持つ
+    feeds = [
+        {"id": feed_id, "title": title}
+        for feed_id, title in db.query(RSSFeed.id, RSSFeed.title).filter(RSSFeed.is_active == True)
+    ]
+
+    # Get unique keywords from articles for filter
+    # カンマ区切りの分割と重複除去はDB側で行い、キーワード名だけを受け取る
+    split = select(
+        func.unnest(func.string_to_array(Article.keywords, ",")).label("name")
+    ).where(Article.keywords != None).subquery()
+    name = func.trim(split.c.name)
+    keywords = [
+        {"name": kw}
+        for (kw,) in db.query(name).filter(name != "").distinct().order_by(name)
+    ]
+    return feeds, keywords
+
+
+def _parse_feed_id(feed_id: Optional[str] = None) -> Optional[int]:
+    """Feed filter from the query string (empty or "すべて" means all feeds)"""
+    if not feed_id or feed_id == "すべて":
+        return None
+    try:
+        return int(feed_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid feed ID")
+
+
+def _is_partial_request(request: Request) -> bool:
+    """Whether an HTMX request wants only the swapped fragment (history restores need the full page)"""
+    return (
+        request.headers.get("HX-Request") == "true"
+        and request.headers.get("HX-History-Restore-Request") != "true"
+    )
+
+
+def _encode_cursor(article: Article) -> str:
+    """Encode an article's (created_at, id) position as an opaque page cursor"""
+    raw = f"{article.created_at.isoformat()}|{article.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, article_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(article_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/articles", response_class=HTMLResponse)
-async def articles_list(
+def articles_list(
     request: Request,
-    page: int = 1,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
     keyword: Optional[str] = None,
-    feed_id: Optional[str] = None,
+    feed_id: Optional[int] = Depends(_parse_feed_id),
     unread_only: bool = True,
     favorite_only: bool = False,
     db: Session = Depends(get_db)
 ):
     """Articles list with filtering"""
     per_page = settings.articles_per_page
-    offset = (page - 1) * per_page
     
     # Build query
-    query = db.query(Article)
+    query = db.query(Article).options(*_ARTICLE_LIST_OPTIONS)
     
     if unread_only:
         query = query.filter(Article.is_read == False)
     
-    if feed_id:
-        if feed_id != "すべて":
-            try:
-                feed_id = int(feed_id)
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid feed ID")
+    if feed_id is not None:
         query = query.filter(Article.feed_id == feed_id)
     
     if keyword:
@@ -109,68 +339,80 @@ async def articles_list(
     if favorite_only:
         query = query.filter(Article.is_favorite == True)
     
-    # Get total count
-    total = query.count()
+    # (created_at, id)のキーセットでページングする（OFFSETで読み飛ばす行や総件数のCOUNTが不要）
+    # 1件多く取得して、その先のページがあるかを判定する
+    position = tuple_(Article.created_at, Article.id)
+    if before:
+        query = query.filter(position > tuple_(*_decode_cursor(before)))
+        articles = query.order_by(Article.created_at, Article.id).limit(per_page + 1).all()
+        has_prev = len(articles) > per_page
+        articles = articles[:per_page][::-1]
+        has_next = True
+    else:
+        if after:
+            query = query.filter(position < tuple_(*_decode_cursor(after)))
+        articles = query.order_by(desc(Article.created_at), desc(Article.id)).limit(per_page + 1).all()
+        has_next = len(articles) > per_page
+        articles = articles[:per_page]
+        has_prev = after is not None
     
-    # Get articles for current page
-    articles = query.order_by(desc(Article.created_at)).offset(offset).limit(per_page).all()
-    start_index = offset + 1 if total > 0 else 0
-    end_index = min(offset + len(articles), total) if total > 0 else 0
+    # ページ移動のリンクで現在のフィルターを引き継ぐ
+    filters = {"unread_only": str(unread_only).lower(), "favorite_only": str(favorite_only).lower()}
+    if keyword:
+        filters["keyword"] = keyword
+    if feed_id is not None:
+        filters["feed_id"] = feed_id
     
-    # Get feeds for filter dropdown
-    feeds = db.query(RSSFeed).filter(RSSFeed.is_active == True).all()
+    context = {
+        "request": request,
+        "articles": articles,
+        "filter_query": urlencode(filters),
+        "prev_cursor": _encode_cursor(articles[0]) if has_prev and articles else None,
+        "next_cursor": _encode_cursor(articles[-1]) if has_next and articles else None,
+    }
     
-    # Get unique keywords from articles for filter
-    keywords_query = db.query(Article.keywords).filter(Article.keywords != None).distinct()
-    keywords = []
-    for k in keywords_query:
-        if k[0]:  # Check if keywords is not None
-            for keyword in k[0].split(','):
-                keyword_stripped = keyword.strip()
-                if keyword_stripped and keyword_stripped not in [k["name"] for k in keywords]:
-                    keywords.append({"name": keyword_stripped})
+    # HTMXによるページ移動では記事一覧の部分だけを返す（ドロップダウンの取得とページ全体の描画を省く）
+    if _is_partial_request(request):
+        return templates.TemplateResponse("_articles_rows.html", context)
     
-    # Calculate pagination
-    total_pages = (total + per_page - 1) // per_page
+    # Get feeds / keywords for filter dropdowns
+    feeds, keywords = _get_filter_options(db)
     
     return templates.TemplateResponse("articles.html", {
-        "request": request,
-        "articles": articles,
+        **context,
         "feeds": feeds,
         "keywords": keywords,
-        "current_page": page,
-        "total_pages": total_pages,
-        "total_articles": total,
         "selected_keyword": keyword or "",
         "selected_feed_id": feed_id,
         "unread_only": unread_only,
         "favorite_only": favorite_only,
-        "start_index": start_index,
-        "end_index": end_index
     })
 
 
 @app.get("/article/{article_id}", response_class=HTMLResponse)
-async def article_detail(request: Request, article_id: int, db: Session = Depends(get_db)):
+def article_detail(request: Request, article_id: int, db: Session = Depends(get_db)):
     """Article detail page"""
-    article = db.query(Article).filter(Article.id == article_id).first()
-    if not article:
+    # 既読にする更新と記事の取得を1回のUPDATE ... RETURNINGで行う
+    row = db.execute(_mark_read_stmt(article_id, get_jst_now())).one_or_none()
+    if not row:
         raise HTTPException(status_code=404, detail="Article not found")
+    article, was_read = row
     
-    # Mark as read
-    article.read_at = get_jst_now()
-    if not article.is_read:
-        article.is_read = True
-    db.commit()
-    
-    return templates.TemplateResponse("article_detail.html", {
+    # commit()で属性が期限切れになる前に描画する（再取得のSELECTを避ける）
+    response = templates.TemplateResponse("article_detail.html", {
         "request": request,
         "article": article
     })
+    db.commit()
+    # 未読件数などが変わるのは初めて開いたときだけ
+    if not was_read:
+        _invalidate_cache()
+    
+    return response
 
 
 @app.get("/feeds", response_class=HTMLResponse)
-async def feeds_list(
+def feeds_list(
     request: Request,
     db: Session = Depends(get_db)
 ):
@@ -186,7 +428,8 @@ async def feeds_list(
 
 
 @app.post("/feeds/add")
-async def add_feed(
+def add_feed(
+    background_tasks: BackgroundTasks,
     url: str = Form(...),
     title: str = Form(...),
     filter_keywords: str = Form(None),
@@ -194,33 +437,41 @@ async def add_feed(
 ):
     """Add new RSS feed"""
     try:
-        # Check if feed already exists
-        existing_feed = db.query(RSSFeed).filter(RSSFeed.url == url).first()
-        if existing_feed:
+        # Create new feed（URLの一意制約に任せて、既存チェックのSELECTをせず1文で登録する）
+        feed_id = db.execute(
+            pg_insert(RSSFeed)
+            .values(url=url, title=title, filter_keywords=filter_keywords)
+            .on_conflict_do_nothing(index_elements=[RSSFeed.url])
+            .returning(RSSFeed.id)
+        ).scalar()
+        if feed_id is None:
             raise HTTPException(status_code=400, detail="Feed already exists")
-        
-        # Create new feed
-        feed = RSSFeed(url=url, title=title, filter_keywords=filter_keywords)
-        db.add(feed)
         db.commit()
         
-        # Try to fetch articles immediately
-        try:
-            feed_data = rss_fetcher.fetch_feed(url)
-            if feed_data:
-                for entry in feed_data.entries[:settings.initial_feed_articles]:  # Limit to configured number of articles for initial fetch
-                    rss_fetcher.save_article(db, feed, entry)
-        except Exception as e:
-            logger.warning(f"Could not fetch articles for new feed: {e}")
+        # 最初の記事の取得はレスポンスを返した後に行う（外部サイトの応答を待たせない）
+        background_tasks.add_task(_fetch_new_feed, feed_id, url)
+        _invalidate_cache()
         
         return RedirectResponse(url="/feeds", status_code=303)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _fetch_new_feed(feed_id: int, url: str) -> None:
+    """Fetch the first articles of a newly added feed"""
+    try:
+        # Limit to configured number of articles for initial fetch
+        if rss_fetcher.fetch_new_feed(feed_id, url, settings.initial_feed_articles):
+            _invalidate_cache()
+    except Exception as e:
+        logger.warning(f"Could not fetch articles for new feed: {e}")
+
+
 @app.post("/feeds/{feed_id}/update-filter")
-async def update_feed_filter(
+def update_feed_filter(
     feed_id: int,
     filter_keywords: str = Form(None),
     db: Session = Depends(get_db)
@@ -231,46 +482,52 @@ async def update_feed_filter(
         raise HTTPException(status_code=404, detail="Feed not found")
     
     feed.filter_keywords = filter_keywords
+    # フィルターが変わったので、次回はフィードが未更新でも全エントリを再評価する
+    feed.etag = None
+    feed.last_modified = None
     db.commit()
+    _invalidate_cache()
     logger.info(f"Updated filter keywords for feed {feed_id}: {filter_keywords}")
     
     return RedirectResponse(url="/feeds", status_code=303)
 
 
 @app.post("/feeds/{feed_id}/toggle")
-async def toggle_feed(
+def toggle_feed(
     feed_id: int,
     db: Session = Depends(get_db)
 ):
     """Toggle feed active status"""
-    feed = db.query(RSSFeed).filter(RSSFeed.id == feed_id).first()
-    if not feed:
+    # 読み込まずにDB側で反転する（NULLは従来の `not` と同じく有効にする）
+    updated = db.query(RSSFeed).filter(RSSFeed.id == feed_id).update(
+        {RSSFeed.is_active: RSSFeed.is_active.isnot(True)}, synchronize_session=False
+    )
+    if not updated:
         raise HTTPException(status_code=404, detail="Feed not found")
-    
-    feed.is_active = not feed.is_active
     db.commit()
+    _invalidate_cache()
     
     return RedirectResponse(url="/feeds", status_code=303)
 
 
 @app.post("/feeds/{feed_id}/delete")
-async def delete_feed(
+def delete_feed(
     feed_id: int,
     db: Session = Depends(get_db)
 ):
     """Delete RSS feed"""
-    feed = db.query(RSSFeed).filter(RSSFeed.id == feed_id).first()
-    if not feed:
+    # 記事の紐付けはDB側の外部キー（ON DELETE SET NULL）が外すので、フィードを読み込まずに1文で削除する
+    deleted = db.query(RSSFeed).filter(RSSFeed.id == feed_id).delete(synchronize_session=False)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Feed not found")
-    
-    db.delete(feed)
     db.commit()
+    _invalidate_cache()
     
     return RedirectResponse(url="/feeds", status_code=303)
 
 
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_panel(
+def admin_panel(
     request: Request,
     db: Session = Depends(get_db)
 ):
@@ -289,23 +546,34 @@ async def admin_panel(
     })
 
 
+# 管理画面の手動実行は時間がかかるので、レスポンスを返した後にバックグラウンドで行う
 @app.post("/admin/fetch-rss")
-async def manual_fetch_rss():
+def manual_fetch_rss(background_tasks: BackgroundTasks):
     """Manually trigger RSS fetch"""
-    scheduler.run_manual_fetch()
+    background_tasks.add_task(_run_manual_fetch)
     return RedirectResponse(url="/admin", status_code=303)
 
 
+def _run_manual_fetch() -> None:
+    scheduler.run_manual_fetch()
+    _invalidate_cache()
+
+
 @app.post("/admin/send-summary")
-async def manual_send_summary():
+def manual_send_summary(background_tasks: BackgroundTasks):
     """Manually trigger summary email"""
-    scheduler.run_manual_summary()
+    background_tasks.add_task(scheduler.run_manual_summary)
     return RedirectResponse(url="/admin", status_code=303)
 
 
 @app.post("/admin/test-email")
-async def test_email():
+def test_email(background_tasks: BackgroundTasks):
     """Test email configuration"""
+    background_tasks.add_task(_send_test_email)
+    return RedirectResponse(url="/admin", status_code=303)
+
+
+def _send_test_email() -> None:
     success = email_sender.test_email_connection()
     if success:
         test_content = "# テストメール\n\nRSS要約システムのメール設定テストです。"
@@ -314,19 +582,23 @@ async def test_email():
             "RSS要約システム - テストメール",
             test_content
         )
-    return RedirectResponse(url="/admin", status_code=303)
 
 
 @app.post("/admin/summarize-all")
-async def summarize_all_articles():
+def summarize_all_articles(background_tasks: BackgroundTasks):
     """Summarize all unsummarized articles"""
+    background_tasks.add_task(_summarize_all_articles)
+    return RedirectResponse(url="/admin", status_code=303)
+
+
+def _summarize_all_articles() -> None:
     count = summarizer.summarize_unsummarized_articles()
+    _invalidate_cache()
     logger.info(f"Summarized {count} articles")
-    return RedirectResponse(url="/admin", status_code=303)
 
 
 @app.post("/article/{article_id}/delete")
-async def delete_article(
+def delete_article(
     article_id: int,
     db: Session = Depends(get_db)
 ):
@@ -338,6 +610,7 @@ async def delete_article(
     # Delete the article
     db.delete(article)
     db.commit()
+    _invalidate_cache()
     logger.info(f"Article {article_id} deleted")
     
     # Redirect to articles list
@@ -345,7 +618,7 @@ async def delete_article(
 
 
 @app.post("/article/{article_id}/favorite")
-async def toggle_favorite_article(
+def toggle_favorite_article(
     request: Request,
     article_id: int,
     favorite: bool = Form(...),
@@ -353,19 +626,20 @@ async def toggle_favorite_article(
     db: Session = Depends(get_db)
 ):
     """お気に入り状態の切り替え"""
-    article = db.query(Article).filter(Article.id == article_id).first()
-    if not article:
+    updated = db.query(Article).filter(Article.id == article_id).update(
+        {Article.is_favorite: favorite}, synchronize_session=False
+    )
+    if not updated:
         raise HTTPException(status_code=404, detail="記事が見つかりません")
-
-    article.is_favorite = favorite
     db.commit()
+    _invalidate_cache()
 
     target_url = redirect_url or request.headers.get("referer") or "/articles"
     return RedirectResponse(url=target_url, status_code=303)
 
 
 @app.post("/articles/delete-multiple")
-async def delete_multiple_articles(
+def delete_multiple_articles(
     article_ids: List[int] = Body(...),
     db: Session = Depends(get_db)
 ):
@@ -379,17 +653,16 @@ async def delete_multiple_articles(
         if not article_ids:
             return {"deleted": 0}
         
-        # 関連するarticle_keywordsテーブルのレコードを先に削除
-        # SQLAlchemyのORM削除を使用して、各記事を個別に削除する
+        # DELETE ... WHERE id IN (...)でまとめて削除する（記事ごとのSELECTとDELETEをしない）
+        # IDが大量でも1文のパラメーター数が膨らまないよう分割し、全体は1つのトランザクションで行う
         deleted_count = 0
-        for article_id in article_ids:
-            article = db.query(Article).filter(Article.id == article_id).first()
-            if article:
-                # 記事を削除すると、SQLAlchemyが自動的に関連するarticle_keywordsのレコードも削除する
-                db.delete(article)
-                deleted_count += 1
+        for start in range(0, len(article_ids), _DELETE_BATCH):
+            deleted_count += db.query(Article).filter(
+                Article.id.in_(article_ids[start:start + _DELETE_BATCH])
+            ).delete(synchronize_session=False)
         
         db.commit()
+        _invalidate_cache()
         logger.info(f"Deleted {deleted_count} articles (IDs: {article_ids})")
         return {"deleted": deleted_count}
     except Exception as e:
@@ -399,27 +672,12 @@ async def delete_multiple_articles(
 
 
 @app.get("/api/stats")
-async def get_stats(db: Session = Depends(get_db)):
+def get_stats(db: Session = Depends(get_db)):
     """API endpoint for statistics"""
-    total_articles = db.query(Article).count()
-    unread_articles = db.query(Article).filter(Article.is_read == False).count()
-    total_feeds = db.query(RSSFeed).filter(RSSFeed.is_active == True).count()
-    
-    # Articles by day (for configured period)
-    days_period = settings.stats_days_period
-    cutoff_date = datetime.now() - timedelta(days=days_period)
-    recent_articles = db.query(Article).filter(Article.created_at >= cutoff_date).all()
-    
-    articles_by_day = {}
-    for article in recent_articles:
-        day = article.created_at.strftime('%Y-%m-%d')
-        articles_by_day[day] = articles_by_day.get(day, 0) + 1
-    
+    snapshot = _get_snapshot(db)
     return {
-        "total_articles": total_articles,
-        "unread_articles": unread_articles,
-        "total_feeds": total_feeds,
-        "articles_by_day": articles_by_day
+        **snapshot["counts"],
+        "articles_by_day": snapshot["articles_by_day"]
     }
 
 
@@ -431,5 +689,7 @@ if __name__ == "__main__":
         "web_app:app",
         host=settings.app_host,
         port=settings.app_port,
+        loop="uvloop",
+        http="httptools",
         reload=settings.debug
     )